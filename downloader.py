@@ -2,12 +2,15 @@
 A rudimentary URL downloader (like wget or curl) to demonstrate Rich progress bars.
 """
 
+import http.client
+import io
 import os.path
 import signal
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from threading import Event
-from typing import Iterable
+from threading import Event, Lock, local
+from typing import Iterable, Tuple
+from urllib.parse import urljoin, urlsplit
 from urllib.request import urlopen
 
 from rich.progress import (
@@ -68,3 +71,123 @@ def download(urls: Iterable[str], dest_dir: str):
                 dest_path = os.path.join(dest_dir, filename)
                 task_id = progress.add_task("download", filename=filename, start=False)
                 pool.submit(copy_url, task_id, url, dest_path)
+
+
+class HttpRangeFile(io.RawIOBase):
+    """
+    Read-only, seekable file over an HTTP(S) URL that fetches only the byte
+    ranges asked for. Every thread keeps its own keep-alive connection, so
+    concurrent pread() calls become concurrent range requests.
+    """
+
+    def __init__(self, url: str, retries: int = 3, timeout: float = 60):
+        super().__init__()
+        self.url = url
+        self.retries = retries
+        self.timeout = timeout
+        self.cursor = 0
+        self._local = local()
+        self._lock = Lock()
+        self._connections = []
+        self.size = self._probe()
+
+    def _connection(self, netloc: str, scheme: str) -> http.client.HTTPConnection:
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get(netloc)
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conn = conns[netloc] = cls(netloc, timeout=self.timeout)
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _drop_connection(self, netloc: str):
+        conn = self._local.conns.pop(netloc, None)
+        if conn is not None:
+            conn.close()
+
+    def _get(self, start: int, end: int) -> Tuple[int, http.client.HTTPMessage, bytes]:
+        """GET bytes [start, end] following redirects, retrying on dropped connections."""
+        for attempt in range(self.retries):
+            url = self.url
+            for _ in range(10):
+                parts = urlsplit(url)
+                path = parts.path + ("?" + parts.query if parts.query else "")
+                conn = self._connection(parts.netloc, parts.scheme)
+                try:
+                    conn.request("GET", path or "/", headers={"Range": f"bytes={start}-{end}"})
+                    response = conn.getresponse()
+                    body = response.read() if response.status == 206 else None
+                except (http.client.HTTPException, OSError):
+                    self._drop_connection(parts.netloc)
+                    if attempt == self.retries - 1:
+                        raise
+                    break
+                if body is None:
+                    # Redirects and servers ignoring Range: the body may be the whole file, so never read it
+                    self._drop_connection(parts.netloc)
+                    body = b""
+                if response.status in (301, 302, 303, 307, 308):
+                    url = urljoin(url, response.getheader("Location"))
+                    continue
+                # Remember where the redirects led, so later ranges skip them
+                self.url = url
+                return response.status, response.headers, body
+            else:
+                raise OSError(f"Too many redirects for {self.url}")
+        raise OSError(f"Could not fetch {self.url}")
+
+    def _probe(self) -> int:
+        status, headers, _ = self._get(0, 0)
+        if status != 206 or not headers.get("Content-Range"):
+            raise OSError(f"{self.url} does not support HTTP range requests")
+        return int(headers["Content-Range"].rsplit("/", 1)[1])
+
+    def pread(self, length: int, offset: int) -> bytes:
+        end = min(offset + length, self.size)
+        if end <= offset:
+            return b""
+        status, _, body = self._get(offset, end - 1)
+        if status != 206 or len(body) != end - offset:
+            raise OSError(f"Bad range response {status} for bytes {offset}-{end - 1} of {self.url}")
+        return body
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = max(0, self.size - self.cursor)
+        data = self.pread(size, self.cursor)
+        self.cursor += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.cursor
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise OSError(22, "Invalid argument")
+        self.cursor = offset
+        return offset
+
+    def tell(self) -> int:
+        return self.cursor
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        super().close()
@@ -1,14 +1,31 @@
 #!/usr/bin/env python
+import bisect
 import bz2
+import collections
+import functools
 import hashlib
+import io
+import json
 import lzma
+import mmap
+import os
+import shutil
 import struct
+import subprocess
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from multiprocessing import cpu_count
 
 import update_metadata_pb2 as um
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 flatten = lambda l: [item for sublist in l for item in sublist]
 
 
@@ -20,6 +37,335 @@ def u64(x):
     return struct.unpack(">Q", x)[0]
 
 
+if hasattr(os, "pwrite"):
+    def pwrite(fd, data, offset):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+
+    def pread(fd, length, offset):
+        return os.pread(fd, length, offset)
+else:
+    # Windows has no positional I/O in the os module, so serialize seek+io pairs.
+    _io_lock = threading.Lock()
+
+    def pwrite(fd, data, offset):
+        with _io_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+
+    def pread(fd, length, offset):
+        with _io_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.read(fd, length)
+
+
+BSDIFF_MAGIC = b"BSDIFF40"
+BSDF2_MAGIC = b"BSDF2"
+SPARSE_HOLE = 0xFFFFFFFFFFFFFFFF  # src extent start_block that stands for zeros
+
+
+def offtin(buf, pos):
+    # bsdiff stores sign-magnitude little-endian 64-bit integers
+    value = struct.unpack_from("<Q", buf, pos)[0]
+    return -(value & 0x7FFFFFFFFFFFFFFF) if value & 0x8000000000000000 else value
+
+
+def bsdiff_stream(kind, data):
+    if kind == 0:
+        return data
+    if kind == 1:
+        return bz2.decompress(data)
+    if kind == 2:
+        if brotli is None:
+            raise RuntimeError("brotli module is required for BROTLI_BSDIFF, pip install brotli")
+        return brotli.decompress(data)
+    raise ValueError("Unknown bsdiff stream compression %d" % kind)
+
+
+def add_bytes(a, b):
+    """Bytewise (a + b) mod 256, done on big integers so it runs at C speed."""
+    n = len(a)
+    if n == 0:
+        return b""
+    x = int.from_bytes(a, "little")
+    y = int.from_bytes(b, "little")
+    low = int.from_bytes(b"\x7f" * n, "little")
+    high = int.from_bytes(b"\x80" * n, "little")
+    # Sum the low 7 bits of each byte without carries, then fix up the top bits with xor
+    return (((x & low) + (y & low)) ^ ((x ^ y) & high)).to_bytes(n, "little")
+
+
+def bspatch(old, patch):
+    """Apply a BSDIFF40 or BSDF2 (bz2/brotli/raw streams) patch to old and return the new data."""
+    if patch[:8] == BSDIFF_MAGIC:
+        kinds = (1, 1, 1)
+    elif patch[:5] == BSDF2_MAGIC:
+        kinds = tuple(patch[5:8])
+    else:
+        raise ValueError("Unknown bsdiff patch magic %r" % bytes(patch[:8]))
+    ctrl_len, diff_len, new_size = offtin(patch, 8), offtin(patch, 16), offtin(patch, 24)
+    if ctrl_len < 0 or diff_len < 0 or new_size < 0:
+        raise ValueError("Corrupt bsdiff header")
+    ctrl = bsdiff_stream(kinds[0], patch[32:32 + ctrl_len])
+    diff = bsdiff_stream(kinds[1], patch[32 + ctrl_len:32 + ctrl_len + diff_len])
+    extra = bsdiff_stream(kinds[2], patch[32 + ctrl_len + diff_len:])
+
+    new = bytearray(new_size)
+    old_size = len(old)
+    new_pos = old_pos = diff_pos = extra_pos = ctrl_pos = 0
+    while new_pos < new_size:
+        if ctrl_pos + 24 > len(ctrl):
+            raise ValueError("Corrupt bsdiff control stream")
+        add_len, copy_len, seek = offtin(ctrl, ctrl_pos), offtin(ctrl, ctrl_pos + 8), offtin(ctrl, ctrl_pos + 16)
+        ctrl_pos += 24
+        if add_len < 0 or copy_len < 0 or new_pos + add_len + copy_len > new_size:
+            raise ValueError("Corrupt bsdiff control stream")
+
+        # Bytes outside the old data count as zero, like the reference bspatch
+        lo, hi = max(old_pos, 0), min(old_pos + add_len, old_size)
+        if lo < hi:
+            old_run = bytes(lo - old_pos) + old[lo:hi] + bytes(old_pos + add_len - hi)
+        else:
+            old_run = bytes(add_len)
+        new[new_pos:new_pos + add_len] = add_bytes(old_run, diff[diff_pos:diff_pos + add_len])
+        new_pos += add_len
+        old_pos += add_len
+        diff_pos += add_len
+
+        new[new_pos:new_pos + copy_len] = extra[extra_pos:extra_pos + copy_len]
+        new_pos += copy_len
+        extra_pos += copy_len
+        old_pos += seek
+    return new
+
+
+def puffpatch(src, patch):
+    """PUFFDIFF needs deflate streams re-encoded bit-exactly, so hand it to the puffin tool."""
+    tool = shutil.which("puffin")
+    if tool is None:
+        raise RuntimeError("PUFFDIFF operations need the puffin tool in PATH")
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, name) for name in ("src", "patch", "dst")]
+        for path, data in zip(paths, (src, patch)):
+            with open(path, "wb") as f:
+                f.write(data)
+        subprocess.run([tool, "--operation=puffpatch", "--src_file=" + paths[0], "--patch_file=" + paths[1],
+                        "--dst_file=" + paths[2]], check=True, stdout=subprocess.DEVNULL)
+        with open(paths[2], "rb") as f:
+            return f.read()
+
+
+def zip_member_offset(zip_file, member="payload.bin"):
+    """
+    Return the absolute offset of a STORED member's data inside a zip, given
+    its path or a seekable file object (e.g. downloader.HttpRangeFile).
+    """
+    with zipfile.ZipFile(zip_file) as zf:
+        info = zf.getinfo(member)
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError("%s is compressed inside %s, extract it first" % (member, zip_file))
+    if hasattr(zip_file, "read"):
+        zip_file.seek(info.header_offset)
+        header = zip_file.read(30)
+    else:
+        with open(zip_file, "rb") as f:
+            f.seek(info.header_offset)
+            header = f.read(30)
+    if header[:4] != b"PK\x03\x04":
+        raise ValueError("Bad local file header for %s in %s" % (member, zip_file))
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    return info.header_offset + 30 + name_len + extra_len
+
+
+class HashMismatchError(Exception):
+    pass
+
+
+class PartitionHasher:
+    """
+    Feeds a partition image to sha256 in block order while its operations
+    complete in any order, reading finished runs back from the output file.
+    """
+    CHUNK = 16 << 20
+
+    def __init__(self, partition, block_size, size, read):
+        self.name = partition.partition_name
+        self.expected = partition.new_partition_info.hash
+        self.block_size = block_size
+        self.size = size
+        self.read = read  # read(length, offset) of the raw image being written
+        self.sha = hashlib.sha256()
+        self.lock = threading.Lock()
+        self.hashing = False
+        self.next_block = 0
+        self.done = {}  # start_block -> num_blocks of finished, not yet hashed runs
+
+        # Blocks no operation writes stay zero from the preallocation, so they are done already
+        block = 0
+        for start, num in sorted((ext.start_block, ext.num_blocks)
+                                 for op in partition.operations for ext in op.dst_extents):
+            if start > block:
+                self.done[block] = start - block
+            block = max(block, start + num)
+        total_blocks = -(-size // block_size)
+        if total_blocks > block:
+            self.done[block] = total_blocks - block
+
+    def complete(self, op):
+        with self.lock:
+            for ext in op.dst_extents:
+                self.done[ext.start_block] = ext.num_blocks
+        self._drain()
+
+    def _drain(self):
+        with self.lock:
+            if self.hashing:
+                # Whoever is hashing will pick the new runs up
+                return
+            self.hashing = True
+        try:
+            while True:
+                with self.lock:
+                    num_blocks = self.done.pop(self.next_block, None)
+                    if num_blocks is None:
+                        self.hashing = False
+                        return
+                self._hash_range(self.next_block * self.block_size,
+                                 min((self.next_block + num_blocks) * self.block_size, self.size))
+                self.next_block += num_blocks
+        except BaseException:
+            with self.lock:
+                self.hashing = False
+            raise
+
+    def _hash_range(self, start, end):
+        while start < end:
+            data = self.read(min(self.CHUNK, end - start), start)
+            if not data:
+                break
+            self.sha.update(data)
+            start += len(data)
+
+    def finish(self):
+        # Catch up in case only zero-filled gaps were left after the last operation
+        self._drain()
+        if self.next_block * self.block_size < self.size:
+            raise HashMismatchError("%s: partition hash could not cover the whole image" % self.name)
+        if self.expected and self.sha.digest() != self.expected:
+            raise HashMismatchError("%s: partition hash mismatch" % self.name)
+
+
+SPARSE_HEADER_MAGIC = 0xED26FF3A
+SPARSE_HEADER_SIZE = 28
+SPARSE_CHUNK_HEADER_SIZE = 12
+CHUNK_TYPE_RAW = 0xCAC1
+CHUNK_TYPE_FILL = 0xCAC2
+CHUNK_TYPE_DONT_CARE = 0xCAC3
+
+
+class SparseLayout:
+    """
+    Android sparse image layout of a partition, worked out from the manifest
+    alone so workers can pwrite decoded data straight to its final offset.
+    ZERO operations become zero FILL chunks, DISCARD operations and blocks
+    no operation touches become DONT_CARE chunks.
+    """
+
+    def __init__(self, partition, block_size, size):
+        self.block_size = block_size
+        self.total_blocks = -(-size // block_size)
+        self.chunks = []  # [chunk_type, start_block, num_blocks]
+
+        intervals = []
+        for op in partition.operations:
+            if op.type == op.DISCARD:
+                kind = CHUNK_TYPE_DONT_CARE
+            elif op.type == op.ZERO:
+                kind = CHUNK_TYPE_FILL
+            else:
+                kind = CHUNK_TYPE_RAW
+            intervals.extend((ext.start_block, ext.num_blocks, kind) for ext in op.dst_extents)
+        intervals.sort()
+
+        block = 0
+        for start, num_blocks, kind in intervals:
+            if start < block:
+                raise ValueError("%s: sparse output needs non-overlapping dst extents" % partition.partition_name)
+            if start > block:
+                self._add(CHUNK_TYPE_DONT_CARE, block, start - block)
+            self._add(kind, start, num_blocks)
+            block = start + num_blocks
+        if self.total_blocks > block:
+            self._add(CHUNK_TYPE_DONT_CARE, block, self.total_blocks - block)
+
+        # File offset of every chunk's payload, RAW chunks indexed by start block for lookups
+        self.offsets = []
+        self.raw_starts = []
+        self.raw_chunks = []
+        offset = SPARSE_HEADER_SIZE
+        for chunk in self.chunks:
+            offset += SPARSE_CHUNK_HEADER_SIZE
+            self.offsets.append(offset)
+            if chunk[0] == CHUNK_TYPE_RAW:
+                self.raw_starts.append(chunk[1])
+                self.raw_chunks.append((chunk[1], chunk[2], offset))
+                offset += chunk[2] * block_size
+            elif chunk[0] == CHUNK_TYPE_FILL:
+                offset += 4
+        self.file_size = offset
+
+    def _add(self, kind, start, num_blocks):
+        if num_blocks == 0:
+            return
+        if self.chunks and self.chunks[-1][0] == kind and self.chunks[-1][1] + self.chunks[-1][2] == start:
+            self.chunks[-1][2] += num_blocks
+        else:
+            self.chunks.append([kind, start, num_blocks])
+
+    def write_headers(self, fd):
+        pwrite(fd, struct.pack("<I4H4I", SPARSE_HEADER_MAGIC, 1, 0, SPARSE_HEADER_SIZE, SPARSE_CHUNK_HEADER_SIZE,
+                               self.block_size, self.total_blocks, len(self.chunks), 0), 0)
+        for (kind, start, num_blocks), offset in zip(self.chunks, self.offsets):
+            data_size = num_blocks * self.block_size if kind == CHUNK_TYPE_RAW else 4 if kind == CHUNK_TYPE_FILL else 0
+            header = struct.pack("<2H2I", kind, 0, num_blocks, SPARSE_CHUNK_HEADER_SIZE + data_size)
+            if kind == CHUNK_TYPE_FILL:
+                header += b"\x00" * 4
+            pwrite(fd, header, offset - SPARSE_CHUNK_HEADER_SIZE)
+
+    def locate(self, start_block):
+        """File offset of a block that lies in a RAW chunk."""
+        index = bisect.bisect_right(self.raw_starts, start_block) - 1
+        if index < 0:
+            raise ValueError("Block %d is not in a RAW chunk" % start_block)
+        chunk_start, num_blocks, offset = self.raw_chunks[index]
+        if start_block >= chunk_start + num_blocks:
+            raise ValueError("Block %d is not in a RAW chunk" % start_block)
+        return offset + (start_block - chunk_start) * self.block_size
+
+    def read(self, fd, length, offset):
+        """Read the raw image view of the sparse file, synthesizing zeros outside RAW chunks."""
+        result = bytearray()
+        end = min(offset + length, self.total_blocks * self.block_size)
+        while offset < end:
+            block = offset // self.block_size
+            index = bisect.bisect_right(self.raw_starts, block) - 1
+            if index >= 0 and block < self.raw_chunks[index][0] + self.raw_chunks[index][1]:
+                chunk_start, num_blocks, chunk_offset = self.raw_chunks[index]
+                run_end = min(end, (chunk_start + num_blocks) * self.block_size)
+                result += pread(fd, run_end - offset, chunk_offset + offset - chunk_start * self.block_size)
+            else:
+                following = self.raw_starts[index + 1] * self.block_size if index + 1 < len(self.raw_starts) else end
+                run_end = min(end, following)
+                result += bytes(run_end - offset)
+            offset = run_end
+        return bytes(result)
+
+
 def verify_contiguous(exts):
     blocks = 0
     for ext in exts:
@@ -29,58 +375,216 @@ def verify_contiguous(exts):
     return True
 
 
+class ImageCache:
+    """
+    On-disk, content-addressed cache of dumped partition images, keyed by the
+    manifest's new_partition_info hash and size, with least recently used
+    entries evicted once the cache grows past max_bytes. Hits are
+    materialized as a reflink where the filesystem supports it, else a
+    hardlink, else a copy.
+    """
+    FICLONE = 0x40049409
+
+    def __init__(self, directory, max_bytes=20 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, partition):
+        info = partition.new_partition_info
+        if not info.hash:
+            return None
+        return os.path.join(self.directory, "%s-%d.img" % (info.hash.hex(), info.size))
+
+    def lookup(self, partition, out_path):
+        """Put the cached image for partition at out_path, return False on a miss."""
+        path = self.path_for(partition)
+        if path is None or not os.path.isfile(path):
+            return False
+        try:
+            if os.path.exists(out_path):
+                os.remove(out_path)
+            self.materialize(path, out_path)
+            # mtime doubles as the LRU clock
+            os.utime(path)
+        except OSError:
+            return False
+        return True
+
+    def store(self, partition, image_path):
+        path = self.path_for(partition)
+        if path is None or os.path.exists(path):
+            return
+        tmp = path + ".tmp%d" % threading.get_ident()
+        try:
+            # The dumped image stays with the caller, so never share its inode
+            self.materialize(image_path, tmp, link=False)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self.evict()
+
+    def materialize(self, src, dst, link=True):
+        try:
+            import fcntl
+            with open(src, "rb") as s, open(dst, "wb") as d:
+                fcntl.ioctl(d.fileno(), self.FICLONE, s.fileno())
+            return
+        except (ImportError, OSError):
+            if os.path.exists(dst):
+                os.remove(dst)
+        if link:
+            try:
+                os.link(src, dst)
+                return
+            except OSError:
+                pass
+        shutil.copyfile(src, dst)
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(".img"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                # Count allocated blocks where known, dumped images are sparse
+                entries.append((st.st_mtime, getattr(st, "st_blocks", st.st_size // 512) * 512, name))
+            total = sum(entry[1] for entry in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+# Rough single-core decode throughput in MiB of output per second, used to estimate how
+# expensive a payload is before dumping it. Diff operations also pay for reading the source.
+DECODE_THROUGHPUT = {
+    "REPLACE": 1500,
+    "REPLACE_BZ": 40,
+    "REPLACE_XZ": 90,
+    "SOURCE_COPY": 1000,
+    "MOVE": 1000,
+    "BSDIFF": 30,
+    "SOURCE_BSDIFF": 30,
+    "BROTLI_BSDIFF": 40,
+    "PUFFDIFF": 10,
+}
+
+
 class Dumper:
     def __init__(
-            self, payloadfile, out, diff=None, old=None, images="", workers=cpu_count()
+            self, payloadfile, out, diff=None, old=None, images="", workers=cpu_count(), offset=0,
+            parallel_ops=False, verify=False, sparse=False, cache=None
     ):
         self.payloadfile = payloadfile
+        self.offset = offset
         self.out = out
         self.diff = diff
         self.old = old
         self.images = images
         self.workers = workers
+        self.parallel_ops = parallel_ops
+        self.verify = verify
+        self.sparse = sparse
+        self.sparse_layouts = {}  # out fd -> SparseLayout while a partition is written sparse
+        self.cache = cache  # ImageCache of verified raw images, or None
+        self.failed = []
+        self.payload_map = None
         self.validate_magic()
 
-    def run(self):
-        if self.images == "":
-            partitions = self.dam.partitions
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self.payload_map is not None:
+            self.payload_map.close()
+            self.payload_map = None
+        self.payloadfile.close()
+
+    def run(self, images=None):
+        """
+        Dump the requested partitions (all of them by default). The manifest is
+        parsed once per Dumper, so run can be called again for more partitions.
+        """
+        images = self.images if images is None else images
+        if images == "":
+            partitions = list(self.dam.partitions)
         else:
             partitions = []
-            for image in self.images:
-                found = False
-                for dam_part in self.dam.partitions:
-                    if dam_part.partition_name == image:
-                        partitions.append(dam_part)
-                        found = True
-                        break
-                if not found:
+            for image in images:
+                if image in self.partition_index:
+                    partitions.append(self.partition_index[image])
+                else:
                     print("Partition %s not found in image" % image)
 
         if len(partitions) == 0:
             print("Not operating on any partitions")
             return 0
 
+        # Operations carry only offsets; their data is sliced out of the mapped payload on demand
         partitions_with_ops = []
         for partition in partitions:
-            operations = []
-            for operation in partition.operations:
-                self.payloadfile.seek(self.data_offset + operation.data_offset)
-                operations.append(
-                    {
-                        "operation": operation,
-                        "data": self.payloadfile.read(operation.data_length),
-                    }
-                )
+            if self.cache is not None and not self.sparse and \
+                    self.cache.lookup(partition, "%s/%s.img" % (self.out, partition.partition_name)):
+                print(f"{partition.partition_name} Done! (cached)")
+                continue
             partitions_with_ops.append(
                 {
                     "partition": partition,
-                    "operations": operations,
+                    "operations": partition.operations,
                 }
             )
 
-        self.payloadfile.close()
+        self.failed = []
+        if not partitions_with_ops:
+            # Every requested partition was served from the image cache
+            return 0
+        self.check_tools(partitions_with_ops)
+
+        if self.payload_map is None:
+            self.map_payload()
+        if self.parallel_ops:
+            self.multiprocess_operations(partitions_with_ops)
+        else:
+            self.multiprocess_partitions(partitions_with_ops)
+
+        if self.failed:
+            raise HashMismatchError("Verification failed for: %s" % ", ".join(self.failed))
 
-        self.multiprocess_partitions(partitions_with_ops)
+    def check_tools(self, partitions):
+        """Fail before dumping anything when an operation needs an external tool that is not installed."""
+        puffdiff = [part["partition"].partition_name for part in partitions
+                    if any(op.type == op.PUFFDIFF for op in part["operations"])]
+        if puffdiff and shutil.which("puffin") is None:
+            raise RuntimeError("PUFFDIFF operations in %s need the puffin tool, which was not found in PATH"
+                               % ", ".join(puffdiff))
+
+    def multiprocess_operations(self, partitions):
+        """Dump all partitions at once, feeding every partition's operations to one shared pool."""
+        with ThreadPoolExecutor(max_workers=self.workers) as executor, \
+                ThreadPoolExecutor(max_workers=max(1, len(partitions))) as feeders:
+            futures = {feeders.submit(self.dump_part, part, executor): part for part in partitions}
+            for future in as_completed(futures):
+                partition_name = futures[future]['partition'].partition_name
+                try:
+                    future.result()
+                    print(f"{partition_name} Done!")
+                except Exception as exc:
+                    print(f"{partition_name} - processing generated an exception: {exc}")
 
     def multiprocess_partitions(self, partitions):
 
@@ -95,7 +599,94 @@ class Dumper:
                 except Exception as exc:
                     print(f"{partition_name} - processing generated an exception: {exc}")
 
+    def inspect(self, images=None, json_file=None):
+        """
+        Summarize what dumping would cost from the manifest alone, without
+        touching operation data: operation counts by type, compressed vs.
+        destination sizes, the largest operation and an estimated decode time.
+        Prints a table, or writes JSON to json_file ("-" for stdout).
+        """
+        images = self.images if images is None else images
+        if images == "":
+            partitions = list(self.dam.partitions)
+        else:
+            partitions = [self.partition_index[image] for image in images if image in self.partition_index]
+
+        type_name = um.InstallOperation.Type.Name
+        report = {"block_size": self.block_size, "partitions": []}
+        for partition in partitions:
+            op_types = collections.Counter()
+            data_length = dst_blocks = 0
+            decode_seconds = 0.0
+            largest = None
+            for op in partition.operations:
+                name = type_name(op.type)
+                blocks = sum(ext.num_blocks for ext in op.dst_extents)
+                op_types[name] += 1
+                data_length += op.data_length
+                dst_blocks += blocks
+                if name in DECODE_THROUGHPUT:
+                    decode_seconds += blocks * self.block_size / (DECODE_THROUGHPUT[name] << 20)
+                if largest is None or op.data_length > largest.data_length:
+                    largest = op
+            report["partitions"].append({
+                "name": partition.partition_name,
+                "size": self.partition_size(partition),
+                "operations": len(partition.operations),
+                "op_types": dict(op_types.most_common()),
+                "data_length": data_length,
+                "dst_blocks": dst_blocks,
+                "dst_bytes": dst_blocks * self.block_size,
+                "largest_operation": None if largest is None else {
+                    "type": type_name(largest.type),
+                    "data_length": largest.data_length,
+                    "dst_blocks": sum(ext.num_blocks for ext in largest.dst_extents),
+                },
+                "estimated_decode_seconds": round(decode_seconds, 2),
+            })
+        report["data_length"] = sum(part["data_length"] for part in report["partitions"])
+        report["dst_bytes"] = sum(part["dst_bytes"] for part in report["partitions"])
+        report["estimated_decode_seconds"] = round(
+            sum(part["estimated_decode_seconds"] for part in report["partitions"]), 2)
+
+        if json_file == "-":
+            print(json.dumps(report, indent=1))
+        elif json_file:
+            with open(json_file, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=1)
+        else:
+            print("%-16s %6s %12s %12s %12s %8s  %s" % (
+                "partition", "ops", "data", "dst", "largest op", "decode s", "operation types"))
+            for part in report["partitions"]:
+                largest = part["largest_operation"] or {"data_length": 0}
+                print("%-16s %6d %12d %12d %12d %8.1f  %s" % (
+                    part["name"], part["operations"], part["data_length"], part["dst_bytes"],
+                    largest["data_length"], part["estimated_decode_seconds"],
+                    ", ".join("%s=%d" % item for item in part["op_types"].items())))
+        return report
+
+    def open_partition(self, name, cache_size=32):
+        """Seekable file object over a partition's image that decodes operations on demand."""
+        return PartitionReader(self, name, cache_size)
+
+    @classmethod
+    def from_zip(cls, zip_file, out, member="payload.bin", **kwargs):
+        """
+        Dump straight from an OTA zip, reading the STORED payload member in
+        place. zip_file is a path or a seekable file object; with a
+        downloader.HttpRangeFile only the selected partitions' data is fetched.
+        """
+        offset = zip_member_offset(zip_file, member)
+        payloadfile = zip_file if hasattr(zip_file, "read") else open(zip_file, "rb")
+        try:
+            return cls(payloadfile, out, offset=offset, **kwargs)
+        except BaseException:
+            if payloadfile is not zip_file:
+                payloadfile.close()
+            raise
+
     def validate_magic(self):
+        self.payloadfile.seek(self.offset)
         magic = self.payloadfile.read(4)
         assert magic == b"CrAU"
         file_format_version = u64(self.payloadfile.read(8))
@@ -110,54 +701,340 @@ class Dumper:
         self.dam = um.DeltaArchiveManifest()
         self.dam.ParseFromString(manifest)
         self.block_size = self.dam.block_size
+        self.partition_index = {partition.partition_name: partition for partition in self.dam.partitions}
+
+    def map_payload(self):
+        try:
+            self.payload_map = mmap.mmap(self.payloadfile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Not mappable (a remote file, a pipe or a >2 GiB file on 32-bit), fall back to pread
+            self.payload_map = None
+
+    def read_op_data(self, op):
+        start = self.data_offset + op.data_offset
+        if self.payload_map is None:
+            if hasattr(self.payloadfile, "pread"):
+                # Remote payloads (downloader.HttpRangeFile) fetch just this range
+                return self.payloadfile.pread(op.data_length, start)
+            return pread(self.payloadfile.fileno(), op.data_length, start)
+        return memoryview(self.payload_map)[start:start + op.data_length]
+
+    def release_op_data(self, op, data):
+        if not isinstance(data, memoryview):
+            return
+        data.release()
+        # Drop the mapped pages again so resident memory tracks the operations in flight
+        if hasattr(mmap, "MADV_DONTNEED") and op.data_length:
+            start = self.data_offset + op.data_offset
+            aligned = start - start % mmap.PAGESIZE
+            self.payload_map.madvise(mmap.MADV_DONTNEED, aligned, start + op.data_length - aligned)
 
-    def data_for_op(self, operation, out_file, old_file):
-        data = operation["data"]
-        op = operation["operation"]
+    def write_extents(self, out_file, extents, data):
+        """Positionally write data across extents in order, so workers never share a cursor."""
+        layout = self.sparse_layouts.get(out_file)
+        view = memoryview(data)
+        for ext in extents:
+            length = ext.num_blocks * self.block_size
+            offset = ext.start_block * self.block_size if layout is None else layout.locate(ext.start_block)
+            pwrite(out_file, view[:length], offset)
+            view = view[length:]
+            if not view:
+                break
 
-        # assert hashlib.sha256(data).digest() == op.data_sha256_hash, 'operation data hash mismatch'
+    def data_for_op(self, op, out_file, old_file, hasher=None):
+        raw = self.read_op_data(op) if op.data_length else b""
+        try:
+            if hasher is not None and op.data_sha256_hash and hashlib.sha256(raw).digest() != op.data_sha256_hash:
+                raise HashMismatchError("%s: operation data hash mismatch at payload offset %d" % (
+                    hasher.name, op.data_offset))
+            self.apply_op(op, raw, out_file, old_file)
+        finally:
+            self.release_op_data(op, raw)
+        if hasher is not None:
+            hasher.complete(op)
 
+    def apply_op(self, op, data, out_file, old_file):
+        data = self.decode_op(op, data, old_file)
+        if data is not None:
+            self.write_extents(out_file, op.dst_extents, data)
+
+    def decode_op(self, op, data, old_file):
+        """Return the bytes op produces across its dst extents, or None if they read as zeros."""
         if op.type == op.REPLACE_XZ:
             dec = lzma.LZMADecompressor()
-            data = dec.decompress(data)
-            out_file.seek(op.dst_extents[0].start_block * self.block_size)
-            out_file.write(data)
+            return dec.decompress(data)
         elif op.type == op.REPLACE_BZ:
             dec = bz2.BZ2Decompressor()
-            data = dec.decompress(data)
-            out_file.seek(op.dst_extents[0].start_block * self.block_size)
-            out_file.write(data)
+            return dec.decompress(data)
         elif op.type == op.REPLACE:
-            out_file.seek(op.dst_extents[0].start_block * self.block_size)
-            out_file.write(data)
-        elif op.type == op.SOURCE_COPY:
+            return data
+        elif op.type in (op.SOURCE_COPY, op.MOVE):
             if not self.diff:
                 print("SOURCE_COPY supported only for differential OTA")
                 sys.exit(-2)
-            out_file.seek(op.dst_extents[0].start_block * self.block_size)
-            for ext in op.src_extents:
-                old_file.seek(ext.start_block * self.block_size)
-                data = old_file.read(ext.num_blocks * self.block_size)
-                out_file.write(data)
-        elif op.type == op.ZERO:
-            for ext in op.dst_extents:
-                out_file.seek(ext.start_block * self.block_size)
-                out_file.write(b"\x00" * ext.num_blocks * self.block_size)
+            return self.read_src(op, old_file)
+        elif op.type in (op.BSDIFF, op.SOURCE_BSDIFF, op.BROTLI_BSDIFF, op.PUFFDIFF):
+            if not self.diff:
+                print("%s supported only for differential OTA" % um.InstallOperation.Type.Name(op.type))
+                sys.exit(-2)
+            src = self.read_src(op, old_file)
+            data = puffpatch(src, data) if op.type == op.PUFFDIFF else bspatch(src, data)
+            if op.dst_length:
+                data = data[:op.dst_length]
+            return data
+        elif op.type in (op.ZERO, op.DISCARD):
+            # The output starts out as one big hole (or FILL/DONT_CARE chunks), nothing to write
+            return None
         else:
             print("Unsupported type = %d" % op.type)
             sys.exit(-1)
 
+    def read_src(self, op, old_file):
+        data = b"".join(
+            bytes(ext.num_blocks * self.block_size) if ext.start_block == SPARSE_HOLE else
+            pread(old_file, ext.num_blocks * self.block_size, ext.start_block * self.block_size)
+            for ext in op.src_extents
+        )
+        if op.src_length:
+            data = data[:op.src_length]
+        if op.src_sha256_hash and hashlib.sha256(data).digest() != op.src_sha256_hash:
+            raise HashMismatchError("source data hash mismatch for %s operation" %
+                                    um.InstallOperation.Type.Name(op.type))
         return data
 
-    def dump_part(self, part):
+    def verify_old_partition(self, partition, old_file):
+        info = partition.old_partition_info
+        if not info.hash:
+            return
+        sha = hashlib.sha256()
+        offset = 0
+        while offset < info.size:
+            data = pread(old_file, min(PartitionHasher.CHUNK, info.size - offset), offset)
+            if not data:
+                break
+            sha.update(data)
+            offset += len(data)
+        if offset != info.size or sha.digest() != info.hash:
+            raise HashMismatchError("%s: source image does not match old_partition_info" % partition.partition_name)
+
+    def partition_size(self, partition):
+        if partition.new_partition_info.size:
+            return partition.new_partition_info.size
+        return max(
+            (ext.start_block + ext.num_blocks for op in partition.operations for ext in op.dst_extents), default=0
+        ) * self.block_size
+
+    def dump_part(self, part, executor=None):
         name = part["partition"].partition_name
-        out_file = open("%s/%s.img" % (self.out, name), "wb")
-        h = hashlib.sha256()
+        out_path = "%s/%s.img" % (self.out, name)
+        if os.path.lexists(out_path):
+            # May be a hardlink into the image cache, which must not be truncated
+            os.remove(out_path)
+        out_file = os.open(out_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+        size = self.partition_size(part["partition"])
+        layout = SparseLayout(part["partition"], self.block_size, size) if self.sparse else None
+        if layout is None:
+            read = functools.partial(pread, out_file)
+        else:
+            read = functools.partial(layout.read, out_file)
+        hasher = PartitionHasher(part["partition"], self.block_size, size, read) if self.verify else None
 
         if self.diff:
-            old_file = open("%s/%s.img" % (self.old, name), "rb")
+            old_file = os.open("%s/%s.img" % (self.old, name), os.O_RDONLY | getattr(os, "O_BINARY", 0))
         else:
             old_file = None
 
-        for op in part["operations"]:
-            data = self.data_for_op(op, out_file, old_file)
+        try:
+            if old_file is not None:
+                self.verify_old_partition(part["partition"], old_file)
+            # Preallocate as a hole so positional writes can land in any order
+            if layout is None:
+                os.ftruncate(out_file, size)
+            else:
+                os.ftruncate(out_file, layout.file_size)
+                layout.write_headers(out_file)
+                self.sparse_layouts[out_file] = layout
+            if executor is None:
+                for op in part["operations"]:
+                    self.data_for_op(op, out_file, old_file, hasher)
+            else:
+                # Bounded pipeline: at most two operations per worker are read/decoded/written at once
+                pending = set()
+                try:
+                    for op in part["operations"]:
+                        if len(pending) >= self.workers * 2:
+                            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                future.result()
+                        pending.add(executor.submit(self.data_for_op, op, out_file, old_file, hasher))
+                    for future in wait(pending)[0]:
+                        future.result()
+                finally:
+                    # Never close the fds under a worker that is still writing
+                    for future in pending:
+                        future.cancel()
+                    wait(pending)
+            if hasher is not None:
+                hasher.finish()
+                # Only verified images may be filed under their manifest hash
+                if self.cache is not None and layout is None:
+                    self.cache.store(part["partition"], out_path)
+        except HashMismatchError:
+            # Don't leave a corrupt image behind for later steps to pick up
+            self.failed.append(name)
+            self.sparse_layouts.pop(out_file, None)
+            os.close(out_file)
+            out_file = None
+            os.remove(out_path)
+            raise
+        finally:
+            if out_file is not None:
+                self.sparse_layouts.pop(out_file, None)
+                os.close(out_file)
+            if old_file is not None:
+                os.close(old_file)
+
+
+class PartitionReader(io.RawIOBase):
+    """
+    Seekable, read-only file object presenting one payload partition as its
+    image. Only the operations covering a requested range are decoded, and
+    the most recently decoded ones are kept in an LRU cache, so ext4.Volume
+    or gettype can look inside a partition without dumping it to disk.
+    """
+
+    def __init__(self, dumper, name, cache_size=32):
+        super().__init__()
+        if name not in dumper.partition_index:
+            raise KeyError("Partition %s not found in payload" % name)
+        if dumper.payload_map is None:
+            dumper.map_payload()
+        self.dumper = dumper
+        self.partition = dumper.partition_index[name]
+        self.block_size = dumper.block_size
+        self.size = dumper.partition_size(self.partition)
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()  # op index -> decoded bytes
+        self.lock = threading.Lock()
+        self.cursor = 0
+        self.old_file = None
+        if dumper.diff:
+            self.old_file = os.open("%s/%s.img" % (dumper.old, name), os.O_RDONLY | getattr(os, "O_BINARY", 0))
+
+        # Sorted (start_block, num_blocks, op index, byte offset in the op's output) of every dst extent
+        extents = []
+        for index, op in enumerate(self.partition.operations):
+            if op.type in (op.ZERO, op.DISCARD):
+                continue
+            position = 0
+            for ext in op.dst_extents:
+                extents.append((ext.start_block, ext.num_blocks, index, position))
+                position += ext.num_blocks * self.block_size
+        extents.sort()
+        self.extents = extents
+        self.starts = [ext[0] for ext in extents]
+
+    def __len__(self):
+        return self.size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        if self.old_file is not None:
+            os.close(self.old_file)
+            self.old_file = None
+        self.cache.clear()
+        super().close()
+
+    def decoded(self, index):
+        with self.lock:
+            if index in self.cache:
+                self.cache.move_to_end(index)
+                return self.cache[index]
+        op = self.partition.operations[index]
+        raw = self.dumper.read_op_data(op) if op.data_length else b""
+        try:
+            # bytes() so the cache never pins the payload mapping
+            data = bytes(self.dumper.decode_op(op, raw, self.old_file))
+        finally:
+            self.dumper.release_op_data(op, raw)
+        with self.lock:
+            self.cache[index] = data
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return data
+
+    def pread(self, length, offset):
+        """Read without touching the cursor, safe to call from several threads."""
+        end = min(offset + length, self.size)
+        result = bytearray()
+        while offset < end:
+            block = offset // self.block_size
+            i = bisect.bisect_right(self.starts, block) - 1
+            if i >= 0 and block < self.extents[i][0] + self.extents[i][1]:
+                start_block, num_blocks, index, position = self.extents[i]
+                run_end = min(end, (start_block + num_blocks) * self.block_size)
+                data = self.decoded(index)
+                begin = position + offset - start_block * self.block_size
+                chunk = data[begin:begin + run_end - offset]
+                # Ops may decode to less than their extents cover, the rest reads as zeros
+                result += chunk + bytes(run_end - offset - len(chunk))
+            else:
+                following = self.starts[i + 1] * self.block_size if i + 1 < len(self.starts) else end
+                run_end = min(end, following)
+                result += bytes(run_end - offset)
+            offset = run_end
+        return bytes(result)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(0, self.size - self.cursor)
+        data = self.pread(size, self.cursor)
+        self.cursor += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.cursor
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise OSError(22, "Invalid argument")
+        self.cursor = offset
+        return offset
+
+    def tell(self):
+        return self.cursor
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Dump or inspect an OTA payload.bin (or the OTA zip holding it)")
+    parser.add_argument("payload", help="payload.bin or OTA zip")
+    parser.add_argument("-o", "--out", default="output", help="output directory")
+    parser.add_argument("-i", "--images", default="", help="comma separated partitions, all by default")
+    parser.add_argument("--inspect", action="store_true", help="only report what dumping would cost")
+    parser.add_argument("--json", help="write the --inspect report as JSON to this file (- for stdout)")
+    args = parser.parse_args()
+
+    images = args.images.split(",") if args.images else ""
+    if zipfile.is_zipfile(args.payload):
+        dumper = Dumper.from_zip(args.payload, args.out, images=images, parallel_ops=True)
+    else:
+        dumper = Dumper(open(args.payload, "rb"), args.out, images=images, parallel_ops=True)
+    with dumper:
+        if args.inspect:
+            dumper.inspect(json_file=args.json)
+        else:
+            os.makedirs(args.out, exist_ok=True)
+            dumper.run()
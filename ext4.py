@@ -1,8 +1,15 @@
+import bisect
+import collections
 import ctypes
 import functools
 import io
 import math
+import mmap
+import os
 import queue
+import struct
+import sys
+import threading
 
 def wcscmp(str_a, str_b):
     for a, b in zip(str_a, str_b):
@@ -31,6 +38,97 @@ class MagicError(Ext4Error):
 
 # ----------------------------- LOW LEVEL ------------------------------
 
+# Directory index (htree) hashes, as in fs/ext4/hash.c
+DX_HASH_LEGACY = 0
+DX_HASH_HALF_MD4 = 1
+DX_HASH_TEA = 2
+DX_HASH_LEGACY_UNSIGNED = 3
+DX_HASH_HALF_MD4_UNSIGNED = 4
+DX_HASH_TEA_UNSIGNED = 5
+
+DX_HASH_DEFAULT_SEED = (0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476)
+
+
+def _rol32(x, s):
+    return ((x << s) | (x >> (32 - s))) & 0xFFFFFFFF
+
+
+def _str2hashbuf(name, num, signed):
+    pad = len(name) | (len(name) << 8)
+    pad = (pad | (pad << 16)) & 0xFFFFFFFF
+    val = pad
+    buf = []
+    for i, c in enumerate(name[:num * 4]):
+        if signed and c >= 0x80:
+            c -= 0x100
+        val = (c + (val << 8)) & 0xFFFFFFFF
+        if i % 4 == 3:
+            buf.append(val)
+            val = pad
+    if len(buf) < num:
+        buf.append(val)
+    buf.extend([pad] * (num - len(buf)))
+    return buf
+
+
+def _half_md4_transform(buf, data):
+    a, b, c, d = buf
+    f = lambda x, y, z: z ^ (x & (y ^ z))
+    g = lambda x, y, z: ((x & y) + ((x ^ y) & z)) & 0xFFFFFFFF
+    h = lambda x, y, z: x ^ y ^ z
+    rounds = (
+        (f, 0, (0, 1, 2, 3, 4, 5, 6, 7), (3, 7, 11, 19)),
+        (g, 0x5A827999, (1, 3, 5, 7, 0, 2, 4, 6), (3, 5, 9, 13)),
+        (h, 0x6ED9EBA1, (3, 7, 2, 6, 1, 5, 0, 4), (3, 9, 11, 15)),
+    )
+    for fn, k, order, shifts in rounds:
+        for i, word in enumerate(order):
+            a = _rol32((a + fn(b, c, d) + data[word] + k) & 0xFFFFFFFF, shifts[i % 4])
+            a, b, c, d = d, a, b, c
+    return [(x + y) & 0xFFFFFFFF for x, y in zip(buf, (a, b, c, d))]
+
+
+def _tea_transform(buf, data):
+    b0, b1 = buf[0], buf[1]
+    a, b, c, d = data
+    total = 0
+    for _ in range(16):
+        total = (total + 0x9E3779B9) & 0xFFFFFFFF
+        b0 = (b0 + ((((b1 << 4) + a) & 0xFFFFFFFF) ^ ((b1 + total) & 0xFFFFFFFF) ^ ((b1 >> 5) + b))) & 0xFFFFFFFF
+        b1 = (b1 + ((((b0 << 4) + c) & 0xFFFFFFFF) ^ ((b0 + total) & 0xFFFFFFFF) ^ ((b0 >> 5) + d))) & 0xFFFFFFFF
+    return [(buf[0] + b0) & 0xFFFFFFFF, (buf[1] + b1) & 0xFFFFFFFF, buf[2], buf[3]]
+
+
+def dx_hash(name, hash_version, seed=None):
+    """Major hash of a raw directory entry name, as stored in htree index entries."""
+    signed = hash_version < DX_HASH_LEGACY_UNSIGNED
+    hash_version %= 3
+
+    if hash_version == DX_HASH_LEGACY:
+        hash0, hash1 = 0x12A3FE2D, 0x37ABE8F9
+        for c in name:
+            if signed and c >= 0x80:
+                c -= 0x100
+            value = (hash1 + (hash0 ^ (c * 7152373))) & 0xFFFFFFFF
+            if value & 0x80000000:
+                value = (value - 0x7FFFFFFF) & 0xFFFFFFFF
+            hash1, hash0 = hash0, value
+        major = (hash0 << 1) & 0xFFFFFFFF
+    else:
+        buf = list(seed) if seed and any(seed) else list(DX_HASH_DEFAULT_SEED)
+        step = 32 if hash_version == DX_HASH_HALF_MD4 else 16
+        for start in range(0, len(name), step):
+            if hash_version == DX_HASH_HALF_MD4:
+                buf = _half_md4_transform(buf, _str2hashbuf(name[start:], 8, signed))
+            else:
+                buf = _tea_transform(buf, _str2hashbuf(name[start:], 4, signed))
+        major = buf[1] if hash_version == DX_HASH_HALF_MD4 else buf[0]
+
+    major &= ~1
+    if major == 0x7FFFFFFF << 1:
+        major = 0x7FFFFFFE << 1
+    return major
+
 class ext4_struct(ctypes.LittleEndianStructure):
     def __getattr__(self, name):
         try:
@@ -72,6 +170,10 @@ class ext4_dir_entry_2(ext4_struct):
         return struct
 
 
+# Fixed part of ext4_dir_entry_2 (inode, rec_len, name_len, file_type), for parsing whole directory blocks
+DIRENT_STRUCT = struct.Struct("<IHBB")
+
+
 class ext4_extent(ext4_struct):
     _fields_ = [
         ("ee_block", ctypes.c_uint),  # 0x0000
@@ -214,12 +316,61 @@ class ext4_inode(ext4_struct):
     ]
 
 
+class ext4_inode_view:
+    """
+    Read-only view of one inode decoded in bulk from its group's inode table (see Volume.inode_table).
+    Commonly used fields come straight from the decoded tuple, any other ext4_inode field is served by a
+    ctypes structure read from the volume on first use. No part of the image is kept mapped.
+    """
+    __slots__ = ("fields", "volume", "offset", "size", "_struct")
+
+    # i_mode, i_uid_lo, i_size_lo, i_atime, i_ctime, i_mtime, i_gid_lo, i_links_count, i_flags, i_block,
+    # i_file_acl_lo, i_size_hi, i_file_acl_hi, i_uid_hi, i_gid_hi
+    BASE_FORMAT = "<HHIIII4xHH4xI4x60s4xII4x2xHHH4x"
+
+    def __init__(self, fields, volume, offset, size):
+        self.fields = fields
+        self.volume = volume
+        self.offset = offset
+        self.size = size
+        self._struct = None
+
+    def struct_for(inode_size):
+        """Precompiled struct.Struct decoding one on-disk inode of inode_size bytes."""
+        if inode_size > ext4_inode.EXT2_GOOD_OLD_INODE_SIZE:
+            return struct.Struct(ext4_inode_view.BASE_FORMAT + "H{0:d}x".format(inode_size - 0x82))
+        return struct.Struct(ext4_inode_view.BASE_FORMAT)
+
+    i_mode = property(lambda self: self.fields[0])
+    i_uid = property(lambda self: (self.fields[13] << 16) | self.fields[1])
+    i_size = property(lambda self: (self.fields[11] << 32) | self.fields[2])
+    i_atime = property(lambda self: self.fields[3])
+    i_ctime = property(lambda self: self.fields[4])
+    i_mtime = property(lambda self: self.fields[5])
+    i_gid = property(lambda self: (self.fields[14] << 16) | self.fields[6])
+    i_links_count = property(lambda self: self.fields[7])
+    i_flags = property(lambda self: self.fields[8])
+    i_file_acl = property(lambda self: (self.fields[12] << 32) | self.fields[10])
+    i_extra_isize = property(lambda self: self.fields[15] if len(self.fields) > 15 else 0)
+
+    def __getattr__(self, name):
+        if self._struct is None:
+            raw = self.volume.read(self.offset, self.size)
+            # Small (128 byte) inodes have no extra fields, leave them zero instead of reading the next inode
+            self._struct = ext4_inode.from_buffer_copy(raw.ljust(ctypes.sizeof(ext4_inode), b"\0"))
+        return getattr(self._struct, name)
+
+
 class ext4_superblock(ext4_struct):
     EXT2_DESC_SIZE = 0x20  # Default value for s_desc_size, if INCOMPAT_64BIT is not set (NEEDS CONFIRMATION)
 
     # s_feature_incompat
     INCOMPAT_64BIT = 0x80  # Uses 64-bit features (e.g. *_hi structure fields in ext4_group_descriptor)
     INCOMPAT_FILETYPE = 0x2  # Directory entries record file type (instead of inode flags)
+
+    # s_flags
+    FLAGS_UNSIGNED_HASH = 0x2  # Directory hashes treat name bytes as unsigned char
+
     _fields_ = [
         ("s_inodes_count", ctypes.c_uint),  # 0x0000
         ("s_blocks_count_lo", ctypes.c_uint),  # 0x0004
@@ -465,15 +616,70 @@ class MappingEntry:
 
             idx += 1
 
+class LRUCache:
+    """Thread-safe bounded mapping that drops the least recently used key and counts hits and misses."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return value
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "max_size": self.max_size}
+
+
 class Volume:
     ROOT_INODE = 2
+    COPY_CHUNK = 1 << 20  # Upper bound of the buffer used when copying cannot stay in the kernel
+    XATTR_INTERN_MAX_SIZE = 256
+    XATTR_INTERN_MAX_COUNT = 1 << 16
 
-    def __init__(self, stream, offset=0, ignore_flags=False, ignore_magic=False):
+    def __init__(self, stream, offset=0, ignore_flags=False, ignore_magic=False,
+                 inode_cache_size=4096, dir_cache_size=256, extent_cache_size=1024, inode_table_cache_size=16,
+                 xattr_block_cache_size=1024):
         self.ignore_flags = ignore_flags
         self.ignore_magic = ignore_magic
         self.offset = offset
         self.platform64 = True  # Initial value needed for Volume.read_struct
         self.stream = stream
+        self.open_backend()
+        self.inode_struct = None  # struct.Struct for the volume's inode size, built with the first inode table
+
+        # The image is never written through a Volume, so parsed metadata stays valid
+        self.inode_cache = LRUCache(inode_cache_size)  # (inode_idx, file_type) -> Inode
+        self.dir_cache = LRUCache(dir_cache_size)  # inode_idx -> ([(raw name, inode_idx, file_type)], {raw name: entry})
+        self.extent_cache = LRUCache(extent_cache_size)  # inode_idx -> optimized [MappingEntry]
+        self.inode_table_cache = LRUCache(inode_table_cache_size)  # group_idx -> [decoded inode]
+        self.xattr_block_cache = LRUCache(xattr_block_cache_size)  # i_file_acl block -> [(name, value)]
+        self.xattr_values = {}  # Interned small xattr values (SELinux labels, capabilities)
 
         # Superblock
         self.superblock = self.read_struct(ext4_superblock, 0x400)
@@ -503,27 +709,179 @@ class Volume:
     def block_size(self):
         return 1 << (10 + self.superblock.s_log_block_size)
 
+    @property
+    def cache_stats(self):
+        return {
+            "inodes": self.inode_cache.stats,
+            "directories": self.dir_cache.stats,
+            "extents": self.extent_cache.stats,
+            "inode_tables": self.inode_table_cache.stats,
+            "xattr_blocks": self.xattr_block_cache.stats,
+        }
+
+    def intern_xattr_value(self, value):
+        """Return one shared object for equal small xattr values, which repeat across most inodes of an image."""
+        if len(value) > Volume.XATTR_INTERN_MAX_SIZE or len(self.xattr_values) >= Volume.XATTR_INTERN_MAX_COUNT:
+            return self.xattr_values.get(value, value)
+        return self.xattr_values.setdefault(value, value)
+
     def get_inode(self, inode_idx, file_type=InodeType.UNKNOWN):
+        inode = self.inode_cache.get((inode_idx, file_type))
+        if inode is not None:
+            return inode
+
         group_idx, inode_table_entry_idx = self.get_inode_group(inode_idx)
 
         inode_table_offset = self.group_descriptors[group_idx].bg_inode_table * self.block_size
         inode_offset = inode_table_offset + inode_table_entry_idx * self.superblock.s_inode_size
+
+        fields = self.inode_table(group_idx)
+        view = ext4_inode_view(fields[inode_table_entry_idx], self, inode_offset, self.superblock.s_inode_size)
          
-        return Inode(self, inode_offset, inode_idx, file_type)
+        return self.inode_cache.put((inode_idx, file_type), Inode(self, inode_offset, inode_idx, file_type, view))
+
+    def inode_table(self, group_idx):
+        """All inodes of a block group decoded at once from its inode table, which is read in one I/O."""
+        cached = self.inode_table_cache.get(group_idx)
+        if cached is not None:
+            return cached
+
+        inode_size = self.superblock.s_inode_size
+        table_offset = self.group_descriptors[group_idx].bg_inode_table * self.block_size
+        table = self.view(table_offset, self.superblock.s_inodes_per_group * inode_size)
+        if len(table) % inode_size != 0:
+            table = table[:len(table) - len(table) % inode_size]
+
+        if self.inode_struct is None:
+            self.inode_struct = ext4_inode_view.struct_for(inode_size)
+        fields = list(self.inode_struct.iter_unpack(table))
+        if isinstance(table, memoryview):
+            table.release()
+
+        return self.inode_table_cache.put(group_idx, fields)
     
     def get_inode_group(self, inode_idx):
         group_idx = (inode_idx - 1) // self.superblock.s_inodes_per_group
         inode_table_entry_idx = (inode_idx - 1) % self.superblock.s_inodes_per_group
         return (group_idx, inode_table_entry_idx)
 
-    def read(self, offset, byte_len):   
-        if self.offset + offset != self.stream.tell():
-            self.stream.seek(self.offset + offset, io.SEEK_SET)
+    def open_backend(self):
+        """
+        Pick how the image is read without a shared cursor, so that several threads can use one volume:
+        a read-only mmap of the stream's file, else os.pread on its descriptor, else the stream's own
+        pread (e.g. dumper.PartitionReader), else seek + read under a lock.
+        """
+        self.mmap = None
+        self.fd = None
+        self.lock = threading.Lock()
 
-        return self.stream.read(byte_len)
+        try:
+            fd = self.stream.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            fd = None
+        self.stream_fd = fd  # Kept for kernel-side copies even when reads go through the mmap
+
+        if fd is not None:
+            try:
+                self.mmap = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+                return
+            except (OSError, ValueError):
+                pass
+            if hasattr(os, "pread"):
+                self.fd = fd
+
+    def clear_caches(self):
+        """Drop all parsed metadata; cached inodes refer back to the volume, so close does this too."""
+        for cache in (self.inode_cache, self.dir_cache, self.extent_cache, self.inode_table_cache,
+                      self.xattr_block_cache):
+            cache.clear()
+        self.xattr_values.clear()
+
+    def close(self):
+        self.clear_caches()
+        if self.mmap is not None:
+            # Cached inodes and tables hold decoded copies, so only a stray view() result could block this
+            self.mmap.close()
+            self.mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def view(self, offset, byte_len):
+        """
+        Zero-copy read where the backend allows it. A memoryview of the mapping keeps the volume from being
+        closed, so it must be consumed within the call that asked for it and never stored.
+        """
+        if self.mmap is not None:
+            start = self.offset + offset
+            return memoryview(self.mmap)[start: start + byte_len]
+        return self.read(offset, byte_len)
+
+    def read(self, offset, byte_len):
+        if self.mmap is not None:
+            start = self.offset + offset
+            return self.mmap[start: start + byte_len]
+        if self.fd is not None:
+            return os.pread(self.fd, byte_len, self.offset + offset)
+        if hasattr(self.stream, "pread"):
+            return self.stream.pread(byte_len, self.offset + offset)
+
+        with self.lock:
+            if self.offset + offset != self.stream.tell():
+                self.stream.seek(self.offset + offset, io.SEEK_SET)
+
+            return self.stream.read(byte_len)
+
+    def copy_to(self, out_fd, offset, out_offset, byte_len):
+        """
+        Copy byte_len bytes at offset in the volume to out_offset in out_fd, inside the kernel with
+        copy_file_range or sendfile when the image is a real file, else in bounded chunks.
+        """
+        done = 0
+
+        if self.stream_fd is not None and hasattr(os, "copy_file_range"):
+            try:
+                while done < byte_len:
+                    copied = os.copy_file_range(self.stream_fd, out_fd, byte_len - done,
+                                                self.offset + offset + done, out_offset + done)
+                    if copied == 0:
+                        raise EndOfStreamError(
+                            "The volume's underlying stream ended {0:d} bytes before EOF.".format(byte_len - done))
+                    done += copied
+                return
+            except OSError:
+                # Cross-device or unsupported on this filesystem, carry on from where it stopped
+                pass
+
+        if self.stream_fd is not None and hasattr(os, "sendfile"):
+            try:
+                os.lseek(out_fd, out_offset + done, os.SEEK_SET)
+                while done < byte_len:
+                    copied = os.sendfile(out_fd, self.stream_fd, self.offset + offset + done, byte_len - done)
+                    if copied == 0:
+                        raise EndOfStreamError(
+                            "The volume's underlying stream ended {0:d} bytes before EOF.".format(byte_len - done))
+                    done += copied
+                return
+            except OSError:
+                pass
+
+        os.lseek(out_fd, out_offset + done, os.SEEK_SET)
+        while done < byte_len:
+            chunk = self.view(offset + done, min(byte_len - done, Volume.COPY_CHUNK))
+            if len(chunk) == 0:
+                raise EndOfStreamError(
+                    "The volume's underlying stream ended {0:d} bytes before EOF.".format(byte_len - done))
+            view = memoryview(chunk)
+            while len(view):
+                view = view[os.write(out_fd, view):]
+            done += len(chunk)
 
     def read_struct(self, structure, offset, platform64=None):
-        raw = self.read(offset, ctypes.sizeof(structure))
+        raw = self.view(offset, ctypes.sizeof(structure))
 
         if hasattr(structure, "_from_buffer_copy"):
             return structure._from_buffer_copy(raw, platform64=platform64 if platform64 != None else self.platform64)
@@ -542,13 +900,13 @@ class Volume:
 
 
 class Inode:
-    def __init__(self, volume, offset, inode_idx, file_type=InodeType.UNKNOWN):
+    def __init__(self, volume, offset, inode_idx, file_type=InodeType.UNKNOWN, inode=None):
         self.inode_idx = inode_idx
         self.offset = offset
         self.volume = volume
 
         self.file_type = file_type
-        self.inode = volume.read_struct(ext4_inode, offset)
+        self.inode = inode if inode is not None else volume.read_struct(ext4_inode, offset)
 
     def __len__(self):
         return self.inode.i_size
@@ -618,7 +976,7 @@ class Inode:
                 xattr_value = raw_data[
                               xattr_entry.e_value_offs + offset: xattr_entry.e_value_offs + offset + xattr_entry.e_value_size]
 
-            yield (xattr_name, xattr_value)
+            yield (sys.intern(xattr_name), self.volume.intern_xattr_value(xattr_value))
 
             i += xattr_entry._size
 
@@ -648,8 +1006,20 @@ class Inode:
                     inode=inode_idx
                 ))
 
-            file_name, inode_idx, file_type = next(
-                filter(lambda entry: entry[0] == part, current_inode.open_dir(decode_name)), (None, None, None))
+            if decode_name == None:
+                # Names decode as utf8 by default, so the cached index (or the htree) can be probed with the encoded part
+                raw_part = part.encode("utf8")
+                entries = current_inode.volume.dir_cache.get(current_inode.inode_idx)
+                if entries is None:
+                    entry = current_inode.htree_lookup(raw_part)
+                    if entry is NotImplemented:
+                        entry = current_inode.dir_entries(probe=False)[1].get(raw_part)
+                else:
+                    entry = entries[1].get(raw_part)
+                _, inode_idx, file_type = entry or (None, None, None)
+            else:
+                file_name, inode_idx, file_type = next(
+                    filter(lambda entry: entry[0] == part, current_inode.open_dir(decode_name)), (None, None, None))
 
             if inode_idx == None:
                 current_path = "/".join(relative_path[:i])
@@ -753,6 +1123,76 @@ class Inode:
         if not self.volume.ignore_flags and not self.is_dir:
             raise Ext4Error("Inode ({inode:d}) is not a directory.".format(inode=self.inode_idx))
 
+        for raw_name, inode_idx, file_type in self.dir_entries()[0]:
+            yield (decode_name(raw_name), inode_idx, file_type)
+
+    def htree_lookup(self, raw_name):
+        """
+        Find raw_name through the directory's hash tree, reading one block per tree level plus the leaf.
+        Returns the (raw name, inode_idx, file_type) entry, None if it does not exist, or NotImplemented
+        when the directory has no usable index and must be scanned linearly.
+        """
+        if (self.inode.i_flags & ext4_inode.EXT4_INDEX_FL) == 0 or \
+                (self.inode.i_flags & ext4_inode.EXT4_INLINE_DATA_FL) != 0:
+            return NotImplemented
+
+        reader = self.open_read()
+        root = reader.read_block(0)
+        # dx_root: "." and ".." entries, then dx_root_info at 0x18 and the dx_entry array at 0x20
+        reserved_zero, hash_version, info_length, indirect_levels = struct.unpack_from("<IBBB", root, 0x18)
+        if reserved_zero != 0 or info_length != 8 or indirect_levels > 2 or hash_version > DX_HASH_TEA_UNSIGNED:
+            return NotImplemented
+        if hash_version <= DX_HASH_TEA and (self.volume.superblock.s_flags & ext4_superblock.FLAGS_UNSIGNED_HASH) != 0:
+            hash_version += DX_HASH_LEGACY_UNSIGNED
+
+        target = dx_hash(raw_name, hash_version, tuple(self.volume.superblock.s_hash_seed))
+
+        block, entries_offset = root, 0x18 + info_length
+        for level in range(indirect_levels + 1):
+            _, count = struct.unpack_from("<HH", block, entries_offset)
+            # The first dx_entry has no hash (it covers everything below the second one)
+            hashes = [0] + [struct.unpack_from("<I", block, entries_offset + 8 * i)[0] for i in range(1, count)]
+            blocks = [struct.unpack_from("<I", block, entries_offset + 8 * i + 4)[0] for i in range(count)]
+            idx = max(bisect.bisect_right(hashes, target) - 1, 0)
+
+            if level < indirect_levels:
+                # dx_node: a fake empty directory entry, then the dx_entry array at 0x8
+                block, entries_offset = reader.read_block(blocks[idx] & 0x0FFFFFFF), 0x8
+                continue
+
+            # Names colliding on a hash continue into the following leaves, flagged by the low hash bit
+            while True:
+                entry = self._find_dirent(reader.read_block(blocks[idx] & 0x0FFFFFFF), raw_name)
+                if entry is not None:
+                    return entry
+                idx += 1
+                if idx >= count:
+                    # A collision run may go on in the next index node, leave that to the linear scan
+                    return None if level == 0 else NotImplemented
+                if (hashes[idx] & ~1) != target:
+                    return None
+
+    def _find_dirent(self, raw_data, raw_name):
+        offset = 0
+        while offset + DIRENT_STRUCT.size <= len(raw_data):
+            inode_idx, rec_len, name_len, file_type = DIRENT_STRUCT.unpack_from(raw_data, offset)
+            if rec_len < 8:
+                break
+            if inode_idx != 0 and name_len == len(raw_name) and file_type != InodeType.CHECKSUM \
+                    and raw_data[offset + 8: offset + 8 + name_len] == raw_name:
+                return (raw_name, inode_idx, file_type)
+            offset += rec_len
+        return None
+
+    def dir_entries(self, probe=True):
+        """
+        Parsed entries of this directory with undecoded names, plus an index of them by name.
+        probe=False skips the cache lookup when the caller has just missed it.
+        """
+        entries = self.volume.dir_cache.get(self.inode_idx) if probe else None
+        if entries is not None:
+            return entries
+
         # # Hash trees are compatible with linear arrays
         if (self.inode.i_flags & ext4_inode.EXT4_INDEX_FL) != 0:
             pass
@@ -760,52 +1200,100 @@ class Inode:
         # Read raw directory content
         raw_data = self.open_read().read()
         offset = 0
+        listing = []
+        unpack_dirent = DIRENT_STRUCT.unpack_from
 
-        while offset < len(raw_data):
-            dirent = ext4_dir_entry_2._from_buffer_copy(raw_data, offset, platform64=self.volume.platform64)
+        while offset + DIRENT_STRUCT.size <= len(raw_data):
+            inode_idx, rec_len, name_len, file_type = unpack_dirent(raw_data, offset)
 
-            if dirent.file_type != InodeType.CHECKSUM:
-                yield (decode_name(dirent.name), dirent.inode, dirent.file_type)
+            if file_type != InodeType.CHECKSUM:
+                listing.append((raw_data[offset + 8: offset + 8 + name_len], inode_idx, file_type))
 
-            offset += dirent.rec_len
+            if rec_len == 0:
+                # Corrupt entry, do not spin on it
+                break
+            offset += rec_len
 
-    def open_read(self):
-        if (self.inode.i_flags & ext4_inode.EXT4_EXTENTS_FL) != 0:
-            # Obtain mapping from extents
-            mapping = []  # List of MappingEntry instances
-
-            nodes = queue.Queue()
-            nodes.put_nowait(self.offset + ext4_inode.i_block.offset)
-
-            while nodes.qsize() != 0:
-                header_offset = nodes.get_nowait()
-                header = self.volume.read_struct(ext4_extent_header, header_offset)
-
-                if not self.volume.ignore_magic and header.eh_magic != 0xF30A:
-                    raise MagicError(
-                        "Invalid magic value in extent header at offset 0x{header_offset:X} of inode {inode:d}: 0x{header_magic:04X} (expected 0xF30A)".format(
-                            header_magic=header.eh_magic,
-                            header_offset=self.inode_idx,
-                            inode=self.inode_idx
-                        ))
+        # Unused entries keep inode 0 and are skipped by the index, the first live entry of a name wins
+        index = {}
+        for entry in listing:
+            if entry[1] != 0:
+                index.setdefault(entry[0], entry)
 
-                if header.eh_depth != 0:
-                    indices = self.volume.read_struct(ext4_extent_idx * header.eh_entries,
-                                                      header_offset + ctypes.sizeof(ext4_extent_header))
-                    for idx in indices: nodes.put_nowait(idx.ei_leaf * self.volume.block_size)
-                else:
-                    extents = self.volume.read_struct(ext4_extent * header.eh_entries,
-                                                      header_offset + ctypes.sizeof(ext4_extent_header))
-                    for extent in extents:
-                        mapping.append(MappingEntry(extent.ee_block, extent.ee_start, extent.ee_len))
+        return self.volume.dir_cache.put(self.inode_idx, (listing, index))
 
-            MappingEntry.optimize(mapping)
+    def open_read(self):
+        if (self.inode.i_flags & ext4_inode.EXT4_EXTENTS_FL) != 0:
+            mapping = self.volume.extent_cache.get(self.inode_idx)
+            if mapping is None:
+                mapping = self.volume.extent_cache.put(self.inode_idx, self.extent_mapping())
             return BlockReader(self.volume, len(self), mapping)
         else:
             # Inode uses inline data
             i_block = self.volume.read(self.offset + ext4_inode.i_block.offset, ext4_inode.i_block.size)
             return io.BytesIO(i_block[:self.inode.i_size])
 
+    def export(self, out):
+        """
+        Write the file's contents to out, a writable binary file or file descriptor, without holding the file in
+        memory. Mapped runs are copied by Volume.copy_to and unmapped blocks are left as holes.
+        """
+        if isinstance(out, int):
+            out_fd = out
+        else:
+            out.flush()
+            out_fd = out.fileno()
+
+        reader = self.open_read()
+        size = len(self)
+        if not isinstance(reader, BlockReader):
+            # Inline data
+            os.lseek(out_fd, 0, os.SEEK_SET)
+            os.write(out_fd, reader.read())
+        else:
+            block_size = self.volume.block_size
+            for entry in reader.block_map:
+                start = entry.file_block_idx * block_size
+                if start >= size:
+                    break
+                self.volume.copy_to(out_fd, entry.disk_block_idx * block_size, start,
+                                    min(entry.block_count * block_size, size - start))
+
+        os.ftruncate(out_fd, size)
+        os.lseek(out_fd, size, os.SEEK_SET)
+
+    def extent_mapping(self):
+        # Obtain mapping from extents
+        mapping = []  # List of MappingEntry instances
+
+        nodes = queue.Queue()
+        nodes.put_nowait(self.offset + ext4_inode.i_block.offset)
+
+        while nodes.qsize() != 0:
+            header_offset = nodes.get_nowait()
+            header = self.volume.read_struct(ext4_extent_header, header_offset)
+
+            if not self.volume.ignore_magic and header.eh_magic != 0xF30A:
+                raise MagicError(
+                    "Invalid magic value in extent header at offset 0x{header_offset:X} of inode {inode:d}: 0x{header_magic:04X} (expected 0xF30A)".format(
+                        header_magic=header.eh_magic,
+                        header_offset=self.inode_idx,
+                        inode=self.inode_idx
+                    ))
+
+            if header.eh_depth != 0:
+                indices = self.volume.read_struct(ext4_extent_idx * header.eh_entries,
+                                                  header_offset + ctypes.sizeof(ext4_extent_header))
+                for idx in indices: nodes.put_nowait(idx.ei_leaf * self.volume.block_size)
+            else:
+                extents = self.volume.read_struct(ext4_extent * header.eh_entries,
+                                                  header_offset + ctypes.sizeof(ext4_extent_header))
+                for extent in extents:
+                    mapping.append(MappingEntry(extent.ee_block, extent.ee_start, extent.ee_len))
+
+        MappingEntry.optimize(mapping)
+        return mapping
+
     @property
     def size_readable(self):
         if self.inode.i_size < 1024:
@@ -840,40 +1328,53 @@ class Inode:
                 pass
         # xattr block(s)
         if check_block and self.inode.i_file_acl != 0:
-            xattrs_block_start = self.inode.i_file_acl * self.volume.block_size
-            xattrs_block = self.volume.read(xattrs_block_start, self.volume.block_size)
-
-            xattrs_header = ext4_xattr_header.from_buffer_copy(xattrs_block)
-            if not self.volume.ignore_magic and xattrs_header.h_magic != 0xEA020000:
-                try:
-                    raise MagicError(
-                        "Invalid magic value in xattrs block header at offset 0x{xattrs_block_start:X} of inode {inode:d}: 0x{xattrs_header} (expected 0xEA020000)".format(
-                            inode=self.inode_idx,
-                            xattrs_block_start=xattrs_block_start,
-                            xattrs_header=xattrs_header.h_magic
-                        ))
-                except:
-                        pass        
-
-            if xattrs_header.h_blocks != 1:
-                raise Ext4Error(
-                    "Invalid number of xattr blocks at offset 0x{xattrs_block_start:X} of inode {inode:d}: {xattrs_header:d} (expected 1)".format(
+            # Inodes with identical attributes share one xattr block, so parse each block once per volume
+            if prefix_override:
+                yield from self._block_xattrs(prefix_override)
+                return
+            xattrs = self.volume.xattr_block_cache.get(self.inode.i_file_acl)
+            if xattrs is None:
+                xattrs = self.volume.xattr_block_cache.put(self.inode.i_file_acl, list(self._block_xattrs()))
+            yield from xattrs
+
+    def _block_xattrs(self, prefix_override={}):
+        xattrs_block_start = self.inode.i_file_acl * self.volume.block_size
+        xattrs_block = self.volume.read(xattrs_block_start, self.volume.block_size)
+
+        xattrs_header = ext4_xattr_header.from_buffer_copy(xattrs_block)
+        if not self.volume.ignore_magic and xattrs_header.h_magic != 0xEA020000:
+            try:
+                raise MagicError(
+                    "Invalid magic value in xattrs block header at offset 0x{xattrs_block_start:X} of inode {inode:d}: 0x{xattrs_header} (expected 0xEA020000)".format(
                         inode=self.inode_idx,
-                        xattrs_header=xattrs_header.h_blocks,
-                        xattrs_block_start=xattrs_block_start
+                        xattrs_block_start=xattrs_block_start,
+                        xattrs_header=xattrs_header.h_magic
                     ))
+            except:
+                    pass        
 
-            offset = 4 * ((ctypes.sizeof(
-                ext4_xattr_header) + 3) // 4)  # The ext4_xattr_entry following the header is aligned on a 4-byte boundary
-            for xattr_name, xattr_value in self._parse_xattrs(xattrs_block[offset:], -offset,
-                                                              prefix_override=prefix_override):
-                yield (xattr_name, xattr_value)
+        if xattrs_header.h_blocks != 1:
+            raise Ext4Error(
+                "Invalid number of xattr blocks at offset 0x{xattrs_block_start:X} of inode {inode:d}: {xattrs_header:d} (expected 1)".format(
+                    inode=self.inode_idx,
+                    xattrs_header=xattrs_header.h_blocks,
+                    xattrs_block_start=xattrs_block_start
+                ))
+
+        offset = 4 * ((ctypes.sizeof(
+            ext4_xattr_header) + 3) // 4)  # The ext4_xattr_entry following the header is aligned on a 4-byte boundary
+        for xattr_name, xattr_value in self._parse_xattrs(xattrs_block[offset:], -offset,
+                                                          prefix_override=prefix_override):
+            yield (xattr_name, xattr_value)
 
 
 class BlockReader:
     # OSError
     EINVAL = 22
 
+    # Shared source of zero bytes for holes, sliced instead of allocated per block
+    ZERO_CHUNK = bytes(1 << 20)
+
     def __init__(self, volume, byte_size, block_map):
         self.byte_size = byte_size
         self.volume = volume
@@ -886,6 +1387,9 @@ class BlockReader:
         MappingEntry.optimize(block_map)
         self.block_map = block_map
 
+        # Sorted first file block of every entry, for bisecting instead of scanning the map
+        self.file_block_starts = [entry.file_block_idx for entry in block_map]
+
     def __repr__(self):
         return "{type_name:s}(byte_size = {size!r:s}, block_map = {block_map!r:s}, volume_uuid = {uuid!r:s})".format(
             block_map=self.block_map,
@@ -894,18 +1398,28 @@ class BlockReader:
             uuid=self.volume.uuid
         )
 
+    def find_entry(self, file_block_idx):
+        """Index of the last mapping entry starting at or before file_block_idx, or -1."""
+        return bisect.bisect_right(self.file_block_starts, file_block_idx) - 1
+
     def get_block_mapping(self, file_block_idx):
         disk_block_idx = None
 
         # Find disk block
-        for entry in self.block_map:
-            if entry.file_block_idx <= file_block_idx < entry.file_block_idx + entry.block_count:
-                block_diff = file_block_idx - entry.file_block_idx
-                disk_block_idx = entry.disk_block_idx + block_diff
-                break
+        idx = self.find_entry(file_block_idx)
+        if idx >= 0:
+            entry = self.block_map[idx]
+            if file_block_idx < entry.file_block_idx + entry.block_count:
+                disk_block_idx = entry.disk_block_idx + file_block_idx - entry.file_block_idx
 
         return disk_block_idx
 
+    def zeros(self, byte_len):
+        while byte_len > 0:
+            chunk = min(byte_len, len(BlockReader.ZERO_CHUNK))
+            yield memoryview(BlockReader.ZERO_CHUNK)[:chunk]
+            byte_len -= chunk
+
     def read(self, byte_len=-1):
         # Parse args
         if byte_len < -1: raise ValueError("byte_len must be non-negative or -1")
@@ -915,24 +1429,34 @@ class BlockReader:
 
         if byte_len == 0: return b""
 
-        # Reading blocks
-        start_block_idx = self.cursor // self.volume.block_size
-        end_block_idx = (self.cursor + byte_len - 1) // self.volume.block_size
-        end_of_stream_check = byte_len
-
-        blocks = [self.read_block(i) for i in range(start_block_idx, end_block_idx - start_block_idx + 1)]
-
-        start_offset = self.cursor % self.volume.block_size
-        if start_offset != 0: blocks[0] = blocks[0][start_offset:]
-        byte_len = (byte_len + start_offset - self.volume.block_size - 1) % self.volume.block_size + 1
-        blocks[-1] = blocks[-1][:byte_len]
-
-        result = b"".join(blocks)
+        # Reading one contiguous disk run per mapping entry, holes in between are zero filled
+        block_size = self.volume.block_size
+        position = self.cursor
+        end = self.cursor + byte_len
+        pieces = []
+
+        idx = max(self.find_entry(position // block_size), 0)
+        while position < end:
+            entry = self.block_map[idx] if idx < len(self.block_map) else None
+            run_start = end if entry is None else max(position, entry.file_block_idx * block_size)
+            if run_start > position:
+                pieces.extend(self.zeros(min(run_start, end) - position))
+                position = min(run_start, end)
+                continue
+
+            run_end = min(end, (entry.file_block_idx + entry.block_count) * block_size)
+            if run_end > position:
+                disk_offset = entry.disk_block_idx * block_size + position - entry.file_block_idx * block_size
+                data = self.volume.view(disk_offset, run_end - position)
+                if len(data) != run_end - position:
+                    raise EndOfStreamError(
+                        "The volume's underlying stream ended {0:d} bytes before EOF.".format(
+                            run_end - position - len(data)))
+                pieces.append(data)
+                position = run_end
+            idx += 1
 
-        # Check read
-        if len(result) != end_of_stream_check:
-            raise EndOfStreamError(
-                "The volume's underlying stream ended {0:d} bytes before EOF.".format(byte_len - len(result)))
+        result = pieces[0] if len(pieces) == 1 and isinstance(pieces[0], bytes) else b"".join(pieces)
 
         self.cursor += len(result)
         return result
@@ -943,7 +1467,7 @@ class BlockReader:
         if disk_block_idx != None:
             return self.volume.read(disk_block_idx * self.volume.block_size, self.volume.block_size)
         else:
-            return bytes([0] * self.volume.block_size)
+            return BlockReader.ZERO_CHUNK[:self.volume.block_size]
 
     def seek(self, seek, seek_mode=io.SEEK_SET):
         if seek_mode == io.SEEK_CUR:
@@ -1,3 +1,4 @@
+import contextlib
 import os
 import struct
 
@@ -16,16 +17,24 @@ formats = ([b'PK', "zip"], [b'OPPOENCRYPT!', "ozip"], [b'7z', "7z"], [b'\x53\xef
 
 
 def gettype(file) -> str:
-    if not os.path.exists(file):
+    """Sniff the type of an image, given a path or a seekable file object (e.g. dumper.PartitionReader)."""
+    is_stream = hasattr(file, "read")
+    if not is_stream and not os.path.exists(file):
         return "fne"
 
+    def open_file():
+        if is_stream:
+            return contextlib.nullcontext(file)
+        return open(file, 'rb')
+
     def compare(header: bytes, number: int = 0) -> int:
-        with open(file, 'rb') as f:
+        with open_file() as f:
             f.seek(number)
             return f.read(len(header)) == header
 
     def is_super(fil) -> any:
-        with open(fil, 'rb') as file_:
+        with open_file() as file_:
+            file_.seek(0, 0)
             buf = bytearray(file_.read(4))
             if len(buf) < 4:
                 return False
@@ -52,6 +61,8 @@ def gettype(file) -> str:
         elif len(f_) == 3:
             if compare(f_[0], f_[2]):
                 return f_[1]
+    if is_stream:
+        return "unknown"
     try:
         if LogoDumper(file, str(None)).check_img(file):
             return 'logo'
@@ -1,9 +1,12 @@
+import contextlib
 import os
 import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from string import printable
 import struct
 
 import ext4
+from lpunpack import SparseImage, SparseReader
 
 if os.name == 'nt':
     from ctypes.wintypes import LPCSTR, DWORD
@@ -27,6 +30,7 @@ class Extractor:
         self.BLOCK_SIZE = 4096
         self.context = []
         self.fs_config = []
+        self.workers = os.cpu_count() or 1  # Threads writing file data, 1 extracts inline
 
     @staticmethod
     def __out_name(file_path, out=1):
@@ -89,11 +93,24 @@ class Extractor:
             w += 1
         return f'{s}{o}{g}{w}'
 
-    def __ext4extractor(self):
+    def __ext4extractor(self, image=None):
         fs_config_file = self.FileName + '_fs_config'
         fuk_symbols = '\\^$.|?*+(){}[]'
         contexts = self.CONFING_DIR + os.sep + self.FileName + "_file_contexts"
 
+        labels = {}  # raw security.selinux value -> label
+        capabilities = {}  # raw security.capability value -> fs_config suffix
+
+        def write_file(entry_inode, file_target, mode, uid, gid):
+            try:
+                with open(file_target, 'wb') as out:
+                    entry_inode.export(out)
+            except Exception and BaseException as e:
+                print(f'[E] Cannot Write {file_target}, Because of {e}')
+            if os.name == 'posix' and os.geteuid() == 0:
+                os.chmod(file_target, int(mode, 8))
+                os.chown(file_target, uid, gid)
+
         def scan_dir(root_inode, root_path=""):
             for entry_name, entry_inode_idx, entry_type in root_inode.open_dir():
                 if entry_name in ['.', '..'] or entry_name.endswith(' (2)'):
@@ -112,14 +129,20 @@ class Extractor:
                         t_p_mkc = tmp_path
                         for fuk_ in fuk_symbols:
                             t_p_mkc = t_p_mkc.replace(fuk_, '\\' + fuk_)
-                        self.context.append(f"/{t_p_mkc} {e.decode('utf8')[:-1]}")
+                        # Images carry a handful of distinct labels, decode each one once
+                        label = labels.get(e)
+                        if label is None:
+                            label = labels[e] = e.decode('utf8')[:-1]
+                        self.context.append(f"/{t_p_mkc} {label}")
                     elif f == 'security.capability':
-                        r = struct.unpack('<5I', e)
-                        if r[1] > 65535:
-                            cap = hex(int(f'{r[3]:04x}{r[1]:04x}', 16))
-                        else:
-                            cap = hex(int(f'{r[3]:04x}{r[2]:04x}{r[1]:04x}', 16))
-                        cap = f" capabilities={cap}"
+                        cap = capabilities.get(e)
+                        if cap is None:
+                            r = struct.unpack('<5I', e)
+                            if r[1] > 65535:
+                                cap = hex(int(f'{r[3]:04x}{r[1]:04x}', 16))
+                            else:
+                                cap = hex(int(f'{r[3]:04x}{r[2]:04x}{r[1]:04x}', 16))
+                            cap = capabilities[e] = f" capabilities={cap}"
                 if entry_inode.is_symlink:
                     try:
                         link_target = entry_inode.open_read().read().decode("utf8")
@@ -148,14 +171,18 @@ class Extractor:
                     file_target = self.EXTRACT_DIR + entry_inode_path.replace(' ', '_').replace('"', '')
                     if os.name == 'nt':
                         file_target = file_target.replace('\\', '/')
-                    try:
-                        with open(file_target, 'wb') as out:
-                            out.write(entry_inode.open_read().read())
-                    except Exception and BaseException as e:
-                        print(f'[E] Cannot Write {file_target}, Because of {e}')
-                    if os.name == 'posix' and os.geteuid() == 0:
-                        os.chmod(file_target, int(mode, 8))
-                        os.chown(file_target, uid, gid)
+                    # The walk stays sequential so fs_config and contexts keep their order, only file data is
+                    # written by the pool
+                    if pool is None:
+                        write_file(entry_inode, file_target, mode, uid, gid)
+                    else:
+                        # Bound the queued files (and the inodes they hold), and surface write errors early
+                        if len(pending) >= 2 * self.workers:
+                            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                            pending.difference_update(done)
+                            for future in done:
+                                future.result()
+                        pending.add(pool.submit(write_file, entry_inode, file_target, mode, uid, gid))
                 elif entry_inode.is_symlink:
                     target = self.EXTRACT_DIR + entry_inode_path.replace(' ', '_')
                     try:
@@ -193,11 +220,27 @@ class Extractor:
         dir_my = self.CONFING_DIR + os.sep
         if not os.path.isdir(dir_my):
             os.makedirs(dir_my)
-        self.__append(os.path.getsize(self.OUTPUT_IMAGE_FILE), dir_my + self.FileName + '_size.txt')
-        with open(self.OUTPUT_IMAGE_FILE, 'rb') as file:
+        with contextlib.ExitStack() as stack:
+            if image is None:
+                file = stack.enter_context(open(self.OUTPUT_IMAGE_FILE, 'rb'))
+                # Sparse images are read in place instead of being converted to a raw copy first
+                image = SparseReader(file) if SparseImage(file).check() else file
+            image_size = getattr(image, 'size', None)
+            if image_size is None:
+                image_size = os.fstat(image.fileno()).st_size
+            self.__append(image_size, dir_my + self.FileName + '_size.txt')
             dir_r = self.__out_name(os.path.basename(self.OUTPUT_IMAGE_FILE).rsplit('.', 1)[0])
             self.DIR = dir_r
-            scan_dir(ext4.Volume(file).root)
+            pending = set()
+            pool = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+            try:
+                with ext4.Volume(image) as volume:
+                    scan_dir(volume.root)
+                    for future in wait(pending)[0]:
+                        future.result()
+            finally:
+                if pool is not None:
+                    pool.shutdown(wait=True)
             self.fs_config.insert(0, '/ 0 2000 0755' if dir_r == 'vendor' else '/ 0 0 0755')
             self.fs_config.insert(1, f'{dir_r} 0 2000 0755' if dir_r == 'vendor' else '/lost+found 0 0 0700')
             self.fs_config.insert(2 if dir_r == 'system' else 1, f'{dir_r} 0 0 0755')
@@ -249,7 +292,11 @@ class Extractor:
         finally:
             ...
 
-    def main(self, target: str, output_dir: str, target_type: str = 'img'):
+    def main(self, target: str, output_dir: str, target_type: str = 'img', image=None):
+        """
+        Extract the ext4 image at target into output_dir. image may be an already open, seekable view of the
+        image (e.g. lpunpack.LogicalPartition), in which case target only names the outputs.
+        """
         self.BASE_DIR_ = output_dir + os.sep
         self.EXTRACT_DIR = os.path.realpath(os.path.dirname(output_dir)) + os.sep + self.__out_name(
             os.path.basename(output_dir))
@@ -257,12 +304,15 @@ class Extractor:
         self.FileName = self.__out_name(os.path.basename(target), out=0)
         self.CONFING_DIR = os.path.dirname(output_dir) + os.sep + 'config'
         if target_type == 'img':
-            with open(os.path.abspath(self.OUTPUT_IMAGE_FILE), 'rb') as f:
-                data = f.read(500000)
+            if image is None:
+                with open(os.path.abspath(self.OUTPUT_IMAGE_FILE), 'rb') as f:
+                    data = f.read(500000)
+            else:
+                data = b''
             if re.search(b'\x4d\x4f\x54\x4f', data):
                 print(".....MOTO structure! Fixing.....")
                 self.fix_moto(os.path.abspath(self.OUTPUT_IMAGE_FILE))
             print("Extracting %s --> %s" % (os.path.basename(target), os.path.basename(self.EXTRACT_DIR)))
             start = dti()
-            self.__ext4extractor()
+            self.__ext4extractor(image)
             print("Done! [%s]" % (dti() - start))
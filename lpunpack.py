@@ -1,4 +1,5 @@
 import argparse
+import bisect
 import copy
 import enum
 import io
@@ -6,6 +7,8 @@ import json
 import os
 import struct
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from string import Template
 from timeit import default_timer as dti
@@ -15,6 +18,11 @@ SPARSE_HEADER_MAGIC = 0xED26FF3A
 SPARSE_HEADER_SIZE = 28
 SPARSE_CHUNK_HEADER_SIZE = 12
 
+CHUNK_TYPE_RAW = 0xCAC1
+CHUNK_TYPE_FILL = 0xCAC2
+CHUNK_TYPE_DONT_CARE = 0xCAC3
+CHUNK_TYPE_CRC32 = 0xCAC4
+
 LP_PARTITION_RESERVED_BYTES = 4096
 LP_METADATA_GEOMETRY_MAGIC = 0x616c4467
 LP_METADATA_GEOMETRY_SIZE = 4096
@@ -606,10 +614,90 @@ class LpUnpackError(Exception):
 class UnpackJob:
     name: str
     geometry: LpMetadataGeometry
-    parts: List[Tuple[int, int]] = field(default_factory=list)
+    parts: List[Tuple[int, int, int]] = field(default_factory=list)  # (target type, offset in super, size)
     total_size: int = field(default=0)
 
 
+COPY_BUFFER_SIZE = 16 << 20  # Largest single read/write when a copy cannot stay in the kernel
+# Windows has no positional I/O in the os module, so seek+io pairs on shared handles are serialized
+_io_lock = threading.Lock()
+
+
+def _pread(src, length: int, offset: int) -> bytes:
+    if hasattr(src, 'pread'):
+        return src.pread(length, offset)
+    if hasattr(os, 'pread'):
+        try:
+            return os.pread(src.fileno(), length, offset)
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            pass
+    with _io_lock:
+        src.seek(offset)
+        return src.read(length)
+
+
+def _pwrite(out_fd: int, data, offset: int):
+    view = memoryview(data)
+    if hasattr(os, 'pwrite'):
+        while len(view):
+            written = os.pwrite(out_fd, view, offset)
+            view = view[written:]
+            offset += written
+        return
+    with _io_lock:
+        os.lseek(out_fd, offset, os.SEEK_SET)
+        while len(view):
+            view = view[os.write(out_fd, view):]
+
+
+def _copy_file_range(src, out_fd: int, offset: int, size: int, out_offset: int):
+    """Copy from a plain file inside the kernel where possible, else through bounded buffers."""
+    done = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            src_fd = src.fileno()
+            while done < size:
+                copied = os.copy_file_range(src_fd, out_fd, size - done, offset + done, out_offset + done)
+                if copied == 0:
+                    raise LpUnpackError('Super image is truncated.')
+                done += copied
+            return
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            # Cross-device, unsupported by the filesystem or not a real file: finish with buffered copies
+            pass
+    while done < size:
+        data = _pread(src, min(COPY_BUFFER_SIZE, size - done), offset + done)
+        if not data:
+            raise LpUnpackError('Super image is truncated.')
+        _pwrite(out_fd, data, out_offset + done)
+        done += len(data)
+
+
+def _write_fill(out_fd: int, pattern: bytes, size: int, out_offset: int):
+    block = pattern * (min(size, COPY_BUFFER_SIZE) // len(pattern) + 1)
+    done = 0
+    while done < size:
+        n = min(len(block) - len(block) % len(pattern), size - done)
+        _pwrite(out_fd, memoryview(block)[:n], out_offset + done)
+        done += n
+
+
+def copy_range(src, out_fd: int, offset: int, size: int, out_offset: int):
+    """
+    Copy size bytes at offset in src, a file or a SparseReader, to out_offset in out_fd. Ranges that read as
+    zeros in a sparse source (DONT_CARE and zero FILL chunks) are skipped so they stay holes in the output.
+    """
+    if not isinstance(src, SparseReader):
+        _copy_file_range(src, out_fd, offset, size, out_offset)
+        return
+    for chunk_type, start, length, source in src.segments(offset, size):
+        dst = out_offset + start - offset
+        if chunk_type == CHUNK_TYPE_RAW:
+            _copy_file_range(src.source, out_fd, source, length, dst)
+        elif chunk_type == CHUNK_TYPE_FILL and source != b'\0\0\0\0':
+            _write_fill(out_fd, source, length, dst)
+
+
 class SparseImage:
     def __init__(self, fd):
         self._fd = fd
@@ -620,57 +708,302 @@ class SparseImage:
         self.header = SparseHeader(self._fd.read(SPARSE_HEADER_SIZE))
         return False if self.header.magic != SPARSE_HEADER_MAGIC else True
 
-    def _read_data(self, chunk_data_size: int):
-        if self.header.chunk_hdr_sz > SPARSE_CHUNK_HEADER_SIZE:
-            self._fd.seek(self.header.chunk_hdr_sz - SPARSE_CHUNK_HEADER_SIZE, 1)
-
-        return self._fd.read(chunk_data_size)
-
-    def unsparse(self):
-        if not self.header:
-            self._fd.seek(0)
-            self.header = SparseHeader(self._fd.read(SPARSE_HEADER_SIZE))
-        chunks = self.header.total_chunks
-        self._fd.seek(self.header.file_hdr_sz - SPARSE_HEADER_SIZE, 1)
+    def unsparse(self, workers: int = 1):
+        """
+        Write the raw image next to the sparse file as <name>.unsparse.img and return its path. RAW chunks are
+        copied with copy_file_range or bounded buffers, non-zero FILL chunks are tiled out and zero FILL and
+        DONT_CARE chunks are left as holes. With workers > 1 the chunks are split into ranges copied in parallel.
+        """
+        reader = SparseReader(self._fd)
+        self.header = reader.header
         unsparse_file_dir = os.path.dirname(self._fd.name)
         unsparse_file = os.path.join(unsparse_file_dir,
                                      "{}.unsparse.img".format(os.path.splitext(os.path.basename(self._fd.name))[0]))
-        with open(str(unsparse_file), 'wb') as out:
-            sector_base = 82528
-            output_len = 0
-            while chunks > 0:
-                chunk_header = SparseChunkHeader(self._fd.read(SPARSE_CHUNK_HEADER_SIZE))
-                sector_size = (chunk_header.chunk_sz * self.header.blk_sz) >> 9
-                chunk_data_size = chunk_header.total_sz - self.header.chunk_hdr_sz
-                if chunk_header.chunk_type == 0xCAC1:
-                    data = self._read_data(chunk_data_size)
-                    len_data = len(data)
-                    if len_data == (sector_size << 9):
-                        out.write(data)
-                        output_len += len_data
-                        sector_base += sector_size
-                elif chunk_header.chunk_type == 0xCAC2:
-                    data = self._read_data(chunk_data_size)
-                    len_data = sector_size << 9
-                    out.truncate(out.tell() + len_data)
-                    out.seek(0, 2)
-                    output_len += len(data)
-                    sector_base += sector_size
-                elif chunk_header.chunk_type == 0xCAC3:
-                    data = self._read_data(chunk_data_size)
-                    len_data = sector_size << 9
-                    out.truncate(out.tell() + len_data)
-                    out.seek(0, 2)
-                    output_len += len(data)
-                    sector_base += sector_size
-                else:
-                    len_data = sector_size << 9
-                    out.truncate(out.tell() + len_data)
-                    out.seek(0, 2)
-                    sector_base += sector_size
-                chunks -= 1
+        out_fd = os.open(unsparse_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+        try:
+            ranges = self._split(reader.chunks(), workers)
+            if len(ranges) > 1:
+                with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                    futures = [executor.submit(copy_range, reader, out_fd, start, length, start)
+                               for start, length in ranges]
+                    for future in futures:
+                        future.result()
+            else:
+                for start, length in ranges:
+                    copy_range(reader, out_fd, start, length, start)
+            os.ftruncate(out_fd, reader.size)
+        finally:
+            os.close(out_fd)
         return unsparse_file
 
+    @staticmethod
+    def _split(chunks: List[Tuple[int, int, int, object]], workers: int) -> List[Tuple[int, int]]:
+        """Group chunks into at most workers (offset, length) ranges carrying about the same amount of data."""
+        chunks = [chunk for chunk in chunks if chunk[0] == CHUNK_TYPE_RAW or
+                  (chunk[0] == CHUNK_TYPE_FILL and chunk[3] != b'\0\0\0\0')]
+        if not chunks:
+            return []
+        share = sum(chunk[2] for chunk in chunks) / max(workers or 1, 1)
+        ranges = []
+        start = chunks[0][1]
+        pending = 0
+        for _, offset, length, _ in chunks:
+            if pending >= share:
+                ranges.append((start, offset - start))
+                start = offset
+                pending = 0
+            pending += length
+        last = chunks[-1]
+        ranges.append((start, last[1] + last[2] - start))
+        return ranges
+
+
+class SparseReader(io.RawIOBase):
+    """
+    Seekable, read-only view of the raw image stored in an Android sparse image. Reads are served from the
+    sparse file in place through a chunk index: RAW chunks are read from their offset in the file, FILL chunks
+    repeat their pattern and DONT_CARE chunks read as zeros.
+    """
+
+    def __init__(self, fd: BinaryIO):
+        super().__init__()
+        self._fd = fd
+        self._pos = 0
+        try:
+            self._fileno = fd.fileno() if hasattr(os, 'pread') else None
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            self._fileno = None
+
+        self.header = SparseHeader(self._pread_source(SPARSE_HEADER_SIZE, 0))
+        if self.header.magic != SPARSE_HEADER_MAGIC:
+            raise LpUnpackError('Not a sparse image.')
+        self.size = self.header.total_blks * self.header.blk_sz
+
+        # Output offset of every chunk, and (type, output offset, length, file offset or fill pattern)
+        self._starts: List[int] = []
+        self._chunks: List[Tuple[int, int, int, object]] = []
+        offset = self.header.file_hdr_sz
+        output_offset = 0
+        for _ in range(self.header.total_chunks):
+            chunk_header = SparseChunkHeader(self._pread_source(SPARSE_CHUNK_HEADER_SIZE, offset))
+            length = chunk_header.chunk_sz * self.header.blk_sz
+            data_offset = offset + self.header.chunk_hdr_sz
+            if chunk_header.chunk_type == CHUNK_TYPE_RAW:
+                self._add(CHUNK_TYPE_RAW, output_offset, length, data_offset)
+            elif chunk_header.chunk_type == CHUNK_TYPE_FILL:
+                self._add(CHUNK_TYPE_FILL, output_offset, length, self._pread_source(4, data_offset))
+            elif chunk_header.chunk_type == CHUNK_TYPE_DONT_CARE:
+                self._add(CHUNK_TYPE_DONT_CARE, output_offset, length, None)
+            elif chunk_header.chunk_type != CHUNK_TYPE_CRC32:
+                raise LpUnpackError(f'Unknown sparse chunk type 0x{chunk_header.chunk_type:04X}')
+            offset += chunk_header.total_sz
+            output_offset += length
+
+    def _add(self, chunk_type: int, output_offset: int, length: int, source):
+        if length:
+            self._starts.append(output_offset)
+            self._chunks.append((chunk_type, output_offset, length, source))
+
+    def _pread_source(self, length: int, offset: int) -> bytes:
+        if self._fileno is not None:
+            return os.pread(self._fileno, length, offset)
+        with _io_lock:
+            self._fd.seek(offset)
+            return self._fd.read(length)
+
+    @property
+    def source(self):
+        """The sparse file itself."""
+        return self._fd
+
+    def chunks(self):
+        """(type, output offset, length, file offset or fill pattern) of every chunk, in output order."""
+        return list(self._chunks)
+
+    def segments(self, offset: int, length: int):
+        """
+        Yield (type, output offset, length, file offset or fill pattern) for the pieces of the chunks covering
+        length bytes at offset, trimmed to that range. Fill patterns are rotated to start at the piece's offset.
+        """
+        end = min(offset + length, self.size)
+        index = max(bisect.bisect_right(self._starts, offset) - 1, 0)
+        while offset < end and index < len(self._chunks):
+            chunk_type, chunk_offset, chunk_length, source = self._chunks[index]
+            index += 1
+            start = max(offset, chunk_offset)
+            stop = min(end, chunk_offset + chunk_length)
+            if start >= stop:
+                continue
+            if chunk_type == CHUNK_TYPE_RAW:
+                source += start - chunk_offset
+            elif chunk_type == CHUNK_TYPE_FILL:
+                phase = (start - chunk_offset) % 4
+                source = source[phase:] + source[:phase]
+            yield chunk_type, start, stop - start, source
+            offset = stop
+
+    def pread(self, length: int, offset: int) -> bytes:
+        length = max(0, min(length, self.size - offset))
+        pieces = []
+        index = bisect.bisect_right(self._starts, offset) - 1
+        end = offset + length
+        while offset < end:
+            if index < 0 or index >= len(self._chunks) or \
+                    offset >= self._chunks[index][1] + self._chunks[index][2]:
+                # Not covered by any chunk
+                gap_end = self._chunks[index + 1][1] if index + 1 < len(self._chunks) else end
+                gap_end = min(max(gap_end, offset), end)
+                if gap_end == offset:
+                    index += 1
+                    continue
+                pieces.append(bytes(gap_end - offset))
+                offset = gap_end
+                continue
+            chunk_type, chunk_offset, chunk_length, source = self._chunks[index]
+            n = min(end, chunk_offset + chunk_length) - offset
+            if chunk_type == CHUNK_TYPE_RAW:
+                data = self._pread_source(n, source + offset - chunk_offset)
+                if len(data) != n:
+                    raise LpUnpackError('Sparse image is truncated.')
+                pieces.append(data)
+            elif chunk_type == CHUNK_TYPE_FILL and source != b'\0\0\0\0':
+                phase = (offset - chunk_offset) % 4
+                pieces.append((source * ((n + phase) // 4 + 1))[phase:phase + n])
+            else:
+                pieces.append(bytes(n))
+            offset += n
+            index += 1
+        return b''.join(pieces)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.pread(len(buffer), self._pos)
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self._pos
+        data = self.pread(size, self._pos)
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position')
+        self._pos = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._pos
+
+
+class LogicalPartition(io.RawIOBase):
+    """
+    Seekable, read-only view of one logical partition inside a super image, mapped through its extents:
+    LINEAR extents read from their sectors of the super image, ZERO extents read as zeros.
+    The super image may be a raw file or a SparseReader.
+    """
+
+    def __init__(self, fd, name: str, extents: List[Tuple[int, int, int]], owner=None):
+        super().__init__()
+        self._fd = fd
+        self._owner = owner
+        self._lock = threading.Lock()
+        self._pos = 0
+        self.name = name
+        # (target type, offset in the partition, size, offset in the super image)
+        self._extents = []
+        offset = 0
+        for target_type, size, super_offset in extents:
+            self._extents.append((target_type, offset, size, super_offset))
+            offset += size
+        self._starts = [extent[1] for extent in self._extents]
+        self.size = offset
+
+        if hasattr(fd, 'pread'):
+            self._pread_super = fd.pread
+        else:
+            try:
+                fileno = fd.fileno() if hasattr(os, 'pread') else None
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                fileno = None
+            if fileno is not None:
+                self._pread_super = lambda length, offset: os.pread(fileno, length, offset)
+            else:
+                self._pread_super = self._locked_read
+
+    def _locked_read(self, length: int, offset: int) -> bytes:
+        with self._lock:
+            self._fd.seek(offset)
+            return self._fd.read(length)
+
+    def pread(self, length: int, offset: int) -> bytes:
+        length = max(0, min(length, self.size - offset))
+        end = offset + length
+        pieces = []
+        index = bisect.bisect_right(self._starts, offset) - 1
+        while offset < end:
+            target_type, extent_offset, size, super_offset = self._extents[index]
+            n = min(end, extent_offset + size) - offset
+            if target_type == LP_TARGET_TYPE_LINEAR:
+                data = self._pread_super(n, super_offset + offset - extent_offset)
+                if len(data) != n:
+                    raise LpUnpackError(f'Super image is truncated inside partition {self.name}.')
+                pieces.append(data)
+            else:
+                pieces.append(bytes(n))
+            offset += n
+            index += 1
+        return b''.join(pieces)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.pread(len(buffer), self._pos)
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self._pos
+        data = self.pread(size, self._pos)
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position')
+        self._pos = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        if not self.closed and self._owner is not None:
+            self._owner.close()
+        super().close()
+
 
 T = TypeVar('T')
 
@@ -682,8 +1015,39 @@ class LpUnpack(object):
         self._show_info_format = kwargs.get('SHOW_INFO_FORMAT', FormatType.TEXT)
         self._config = kwargs.get('CONFIG', None)
         self._slot_num = None
-        self._fd: BinaryIO = open(kwargs.get('SUPER_IMAGE'), 'rb')
+        self._path = kwargs.get('SUPER_IMAGE')
+        self._fd: BinaryIO = open(self._path, 'rb')
+        self._local = threading.local()  # Private handle of each unpack worker thread
         self._out_dir = kwargs.get('OUTPUT_DIR', None)
+        self._workers = kwargs.get('WORKERS', 1)  # Partitions extracted concurrently by unpack
+        self._metadata = None  # Parsed once, then shared by get_info, unpack and open_partition
+        self._keep_open = False  # Set while used as a context manager, so several calls share one handle
+
+    def __enter__(self):
+        self._keep_open = True
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._keep_open = False
+        self.close()
+
+    def _release(self):
+        if not self._keep_open:
+            self.close()
+
+    def _open_image(self):
+        """Sparse super images are read in place rather than converted to a raw copy."""
+        if not isinstance(self._fd, SparseReader) and SparseImage(self._fd).check():
+            print('Sparse image detected, reading it in place.')
+            self._fd = SparseReader(self._fd)
+
+    @property
+    def metadata(self) -> Metadata:
+        if self._metadata is None:
+            self._open_image()
+            self._fd.seek(0)
+            self._metadata = self._read_metadata()
+        return self._metadata
 
     def _check_out_dir_exists(self):
         if self._out_dir is None:
@@ -698,30 +1062,60 @@ class LpUnpack(object):
         print(f'Extracting partition [{unpack_job.name}]')
         out_file = os.path.join(self._out_dir, f'{unpack_job.name}.img')
         with open(str(out_file), 'wb') as out:
-            for part in unpack_job.parts:
-                offset, size = part
-                self._write_extent_to_file(out, offset, size, unpack_job.geometry.logical_block_size)
+            out_offset = 0
+            for target_type, offset, size in unpack_job.parts:
+                # ZERO extents are left as holes
+                if target_type == LP_TARGET_TYPE_LINEAR:
+                    self._write_extent_to_file(out.fileno(), offset, size, out_offset)
+                out_offset += size
+            out.truncate(unpack_job.total_size)
 
-        print('Done:[%s]' % (dti() - start))
+        print('Done [%s]:[%s]' % (unpack_job.name, dti() - start))
 
     def _extract(self, partition, metadata):
         unpack_job = UnpackJob(name=partition.name, geometry=metadata.geometry)
 
-        if partition.num_extents != 0:
-            for extent_number in range(partition.num_extents):
-                index = partition.first_extent_index + extent_number
-                extent = metadata.extents[index]
-
-                if extent.target_type != LP_TARGET_TYPE_LINEAR:
-                    raise LpUnpackError(f'Unsupported target type in extent: {extent.target_type}')
-
-                offset = extent.target_data * LP_SECTOR_SIZE
-                size = extent.num_sectors * LP_SECTOR_SIZE
-                unpack_job.parts.append((offset, size))
-                unpack_job.total_size += size
+        for target_type, size, offset in self._partition_extents(partition, metadata):
+            unpack_job.parts.append((target_type, offset, size))
+            unpack_job.total_size += size
 
         self._extract_partition(unpack_job)
 
+    @staticmethod
+    def _partition_extents(partition, metadata) -> List[Tuple[int, int, int]]:
+        """(target type, size, offset in the super image) of each extent of a partition, in partition order."""
+        extents = []
+        for extent_number in range(partition.num_extents):
+            extent = metadata.extents[partition.first_extent_index + extent_number]
+            if extent.target_type == LP_TARGET_TYPE_LINEAR:
+                if extent.target_source != 0:
+                    raise LpUnpackError(f'Partition {partition.name} spans another block device.')
+                extents.append((LP_TARGET_TYPE_LINEAR, extent.num_sectors * LP_SECTOR_SIZE,
+                                extent.target_data * LP_SECTOR_SIZE))
+            elif extent.target_type == LP_TARGET_TYPE_ZERO:
+                extents.append((LP_TARGET_TYPE_ZERO, extent.num_sectors * LP_SECTOR_SIZE, 0))
+            else:
+                raise LpUnpackError(f'Unsupported target type in extent: {extent.target_type}')
+        return extents
+
+    def open_partition(self, name: str) -> LogicalPartition:
+        """
+        Map a logical partition of the super image without copying it out. Sparse super images are read
+        in place. Outside a with block the returned view owns this LpUnpack and closes it with itself.
+        """
+        metadata = self.metadata
+        for partition in metadata.partitions:
+            if partition.name == name:
+                return LogicalPartition(self._fd, name, self._partition_extents(partition, metadata),
+                                        owner=None if self._keep_open else self)
+        raise LpUnpackError(f'Could not find partition: {name}')
+
+    def close(self):
+        if isinstance(self._fd, SparseReader):
+            self._fd.close()
+            self._fd = self._fd._fd
+        self._fd.close()
+
     def _get_data(self, count: int, size: int, clazz: T) -> List[T]:
         result = []
         while count > 0:
@@ -729,13 +1123,6 @@ class LpUnpack(object):
             count -= 1
         return result
 
-    def _read_chunk(self, block_size):
-        while True:
-            data = self._fd.read(block_size)
-            if not data:
-                break
-            yield data
-
     def _read_metadata_header(self, metadata: Metadata):
         offsets = metadata.get_offsets()
         for index, offset in enumerate(offsets):
@@ -812,28 +1199,21 @@ class LpUnpack(object):
         else:
             return LpMetadataGeometry(self._fd.read(LP_METADATA_GEOMETRY_SIZE))
 
-    def _write_extent_to_file(self, fd: IO, offset: int, size: int, block_size: int):
-        self._fd.seek(offset)
-        for block in self._read_chunk(block_size):
-            if size == 0:
-                break
-
-            fd.write(block)
+    def _write_extent_to_file(self, out_fd: int, offset: int, size: int, out_offset: int):
+        """Copy exactly size bytes of the super image at offset to out_offset in the output."""
+        copy_range(getattr(self._local, 'fd', self._fd), out_fd, offset, size, out_offset)
 
-            size -= block_size
+    def _extract_in_worker(self, partition, metadata, handles: List[BinaryIO]):
+        """Extract on a handle of the super image private to the calling worker thread."""
+        if getattr(self._local, 'fd', None) is None:
+            fd = open(self._path, 'rb')
+            handles.append(fd)
+            self._local.fd = SparseReader(fd) if isinstance(self._fd, SparseReader) else fd
+        self._extract(partition, metadata)
 
     def get_info(self):
         try:
-            if SparseImage(self._fd).check():
-                print('Sparse image detected.')
-                print('Process conversion to non sparse image...')
-                unsparse_file = SparseImage(self._fd).unsparse()
-                self._fd.close()
-                self._fd = open(str(unsparse_file), 'rb')
-                print('Result:[ok]')
-
-            self._fd.seek(0)
-            metadata = self._read_metadata()
+            metadata = self.metadata
 
             filter_partition = []
             for index, partition in enumerate(metadata.partitions):
@@ -849,20 +1229,18 @@ class LpUnpack(object):
             sys.exit(1)
 
         finally:
-            self._fd.close()
-
-    def unpack(self):
+            self._release()
+
+    def unpack(self, names: List[str] = None, out_dir: str = None, workers: int = None):
+        if names is not None:
+            self._partition_name = names
+        if out_dir is not None:
+            self._out_dir = out_dir
+        if workers is not None:
+            self._workers = workers
         try:
-            if SparseImage(self._fd).check():
-                print('Sparse image detected.')
-                print('Process conversion to non sparse image...')
-                unsparse_file = SparseImage(self._fd).unsparse()
-                self._fd.close()
-                self._fd = open(str(unsparse_file), 'rb')
-                print('Result:[ok]')
-
-            self._fd.seek(0)
-            metadata = self._read_metadata()
+            metadata = self.metadata
+            partitions = metadata.partitions
 
             if self._partition_name:
                 filter_partition = []
@@ -873,41 +1251,77 @@ class LpUnpack(object):
                 if not filter_partition:
                     raise LpUnpackError(f'Could not find partition: {self._partition_name}')
 
-                metadata.partitions = filter_partition
+                partitions = filter_partition
 
             if self._slot_num:
                 if self._slot_num > metadata.geometry.metadata_slot_count:
                     raise LpUnpackError(f'Invalid metadata slot number: {self._slot_num}')
 
             if self._show_info:
+                # The cached metadata keeps every partition, only show the selected ones
+                shown = copy.copy(metadata)
+                shown.partitions = partitions
                 if self._show_info_format == FormatType.TEXT:
-                    print(metadata)
+                    print(shown)
                 elif self._show_info_format == FormatType.JSON:
-                    print(f"{metadata.to_json()}\n")
+                    print(f"{shown.to_json()}\n")
 
             if not self._show_info and self._out_dir is None:
                 raise LpUnpackError(message=f'Not specified directory for extraction')
 
             if self._out_dir:
-                for partition in metadata.partitions:
-                    self._extract(partition, metadata)
+                workers = min(self._workers or 1, len(partitions))
+                if workers > 1:
+                    start = dti()
+                    handles = []
+                    try:
+                        with ThreadPoolExecutor(max_workers=workers) as executor:
+                            futures = [executor.submit(self._extract_in_worker, partition, metadata, handles)
+                                       for partition in partitions]
+                            for future in futures:
+                                future.result()
+                    finally:
+                        for fd in handles:
+                            fd.close()
+                    print('Extracted %d partitions with %d workers:[%s]' % (len(partitions), workers, dti() - start))
+                else:
+                    for partition in partitions:
+                        self._extract(partition, metadata)
 
         except LpUnpackError as e:
             print(e.message)
             sys.exit(1)
 
         finally:
-            self._fd.close()
+            self._release()
 
 
-def unpack(file: str, out: str, parts: list = None):
-    namespace = argparse.Namespace(SUPER_IMAGE=file, OUTPUT_DIR=out, SHOW_INFO=False, NAME=parts)
+def unpack(file: str, out: str, parts: list = None, workers: int = 1):
+    namespace = argparse.Namespace(SUPER_IMAGE=file, OUTPUT_DIR=out, SHOW_INFO=False, NAME=parts, WORKERS=workers)
     if not os.path.exists(namespace.SUPER_IMAGE):
         raise FileNotFoundError("%s Cannot Find" % namespace.SUPER_IMAGE)
     else:
         LpUnpack(**vars(namespace)).unpack()
 
 
+def open_partition(file: str, name: str) -> LogicalPartition:
+    if not os.path.exists(file):
+        raise FileNotFoundError("%s Cannot Find" % file)
+    lp = LpUnpack(SUPER_IMAGE=file, SHOW_INFO=False)
+    try:
+        return lp.open_partition(name)
+    except BaseException:
+        lp.close()
+        raise
+
+
+def open_super(file: str) -> LpUnpack:
+    """Persistent handle on a super image for several get_info/unpack/open_partition calls, use it in a with block."""
+    if not os.path.exists(file):
+        raise FileNotFoundError("%s Cannot Find" % file)
+    return LpUnpack(SUPER_IMAGE=file, SHOW_INFO=False)
+
+
 def get_parts(file_):
     namespace = argparse.Namespace(SUPER_IMAGE=file_, SHOW_INFO=False)
     if not os.path.exists(namespace.SUPER_IMAGE):
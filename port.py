@@ -1,7 +1,9 @@
 import argparse
+import contextlib
 import errno
 import glob
 import hashlib
+import http.client
 import os
 import platform
 import re
@@ -14,7 +16,7 @@ from _socket import gethostname
 import downloader
 from gettype import gettype
 import zipfile
-from lpunpack import unpack as lpunpack, SparseImage, get_parts
+from lpunpack import SparseImage, SparseReader, open_super
 from imgextractor import Extractor
 from datetime import datetime, timezone
 import xml.etree.ElementTree as ET
@@ -23,7 +25,7 @@ from fspatch import main as fspatch
 from contextpatch import main as context_patch
 from locale import getlocale
 from rich.progress import track
-from dumper import Dumper
+from dumper import Dumper, ImageCache
 from git import Repo
 
 javaOpts = "-Xmx1024M -Dfile.encoding=utf-8 -Djdk.util.zip.disableZip64ExtraFieldValidation=true -Djdk.nio.zipfs.allowDotZipEntry=true"
@@ -169,6 +171,17 @@ def read_config(file, name):
     return ""
 
 
+def image_cache():
+    cache_dir = read_config('bin/port_config', 'image_cache_dir')
+    if not cache_dir:
+        return None
+    try:
+        max_gb = float(read_config('bin/port_config', 'image_cache_size') or 20)
+    except ValueError:
+        max_gb = 20
+    return ImageCache(cache_dir, int(max_gb * (1 << 30)))
+
+
 def update_netlink(netlink_version, prop_file):
     if not os.path.exists(prop_file):
         return ''
@@ -420,12 +433,18 @@ def find_folder_mh(directory, filename):
     return ''
 
 
+def sparse_type(path):
+    """gettype() of the raw image stored inside a sparse image, read in place."""
+    with open(path, 'rb') as fd:
+        return gettype(SparseReader(fd))
+
+
 def simg2img(path):
     with open(path, 'rb') as fd:
         if SparseImage(fd).check():
             print('Sparse image detected.')
             print('Converting to raw image...')
-            unsparse_file = SparseImage(fd).unsparse()
+            unsparse_file = SparseImage(fd).unsparse(workers=os.cpu_count() or 1)
             print('Result:[ok]')
         else:
             print(f"{path} not Sparse.Skip!")
@@ -528,8 +547,38 @@ def patch_smali(file, smail, old, new, port_android_sdk, regex=False):
         red(f"Failed to find {file},please check it manually")
 
 
+def is_url(rom):
+    return rom.startswith(('http://', 'https://'))
+
+
+@contextlib.contextmanager
+def open_rom(rom):
+    """Open a ROM zip by path, or over HTTP range requests when it is a URL that was not downloaded."""
+    if is_url(rom):
+        with downloader.HttpRangeFile(rom) as f, zipfile.ZipFile(f) as zf:
+            yield zf
+    else:
+        with zipfile.ZipFile(rom) as zf:
+            yield zf
+
+
+def rom_file(rom):
+    return downloader.HttpRangeFile(rom) if is_url(rom) else rom
+
+
+def is_remote_payload(url):
+    """True if the OTA behind url can be dumped remotely: range requests work and payload.bin is STORED."""
+    try:
+        with open_rom(url) as rom:
+            return rom.getinfo('payload.bin').compress_type == zipfile.ZIP_STORED
+    except (OSError, KeyError, zipfile.BadZipFile, http.client.HTTPException):
+        return False
+
+
 def main(baserom, portrom):
-    if not os.path.exists(os.path.basename(baserom)):
+    if not os.path.exists(os.path.basename(baserom)) and is_url(baserom) and is_remote_payload(baserom):
+        blue("底包为一个链接，将按需读取所需分区", "Download link detected, reading partitions remotely.")
+    elif not os.path.exists(os.path.basename(baserom)):
         if 'http' in baserom:
             blue("底包为一个链接，正在下载", "Download link detected, start downloding.")
             try:
@@ -541,7 +590,9 @@ def main(baserom, portrom):
         else:
             red("BASEROM: Invalid parameter")
             sys.exit()
-    if not os.path.exists(os.path.basename(portrom)):
+    if not os.path.exists(os.path.basename(portrom)) and is_url(portrom) and is_remote_payload(portrom):
+        blue("移植包为一个链接，将按需读取所需分区", "Download link detected, reading partitions remotely.")
+    elif not os.path.exists(os.path.basename(portrom)):
         if 'http' in portrom:
             blue("移植包为一个链接，正在下载", "Download link detected, start downloding.")
             try:
@@ -567,7 +618,7 @@ def main(baserom, portrom):
         device_code = baserom.split('_')[2]
     is_shennong_houji_port = device_code.upper() in ['SHENNONG', 'HOUJI']
     blue("正在检测ROM底包", "Validating BASEROM..")
-    with zipfile.ZipFile(baserom) as rom:
+    with open_rom(baserom) as rom:
         if "payload.bin" in rom.namelist():
             baserom_type = 'payload'
             super_list = ['vendor', 'mi_ext', 'odm', 'odm_dlkm', 'system', 'system_dlkm', 'vendor_dlkm', 'product',
@@ -580,7 +631,7 @@ def main(baserom, portrom):
             red("底包中未发现payload.bin以及br文件，请使用MIUI官方包后重试",
                 "payload.bin/new.br not found, please use HyperOS official OTA zip package.")
             sys.exit()
-    with zipfile.ZipFile(portrom) as rom:
+    with open_rom(portrom) as rom:
         if "payload.bin" in rom.namelist():
             green("ROM初步检测通过", "ROM validation passed.")
         elif [True for i in rom.namelist() if 'xiaomi.eu' in i]:
@@ -615,16 +666,7 @@ def main(baserom, portrom):
         if not os.path.exists(i):
             os.makedirs(i)
     # Extract BaseRom Zip
-    if baserom_type == 'payload':
-        blue("正在提取底包 [payload.bin]", "Extracting files from BASEROM [payload.bin]")
-        with zipfile.ZipFile(baserom) as rom:
-            try:
-                rom.extract('payload.bin', path='build/baserom')
-            except:
-                red("解压底包 [payload.bin] 时出错", "Extracting [payload.bin] error")
-                sys.exit()
-            green("底包 [payload.bin] 提取完毕", "[payload.bin] extracted.")
-    elif baserom_type == 'br':
+    if baserom_type == 'br':
         blue("正在提取底包 [new.dat.br]", "Extracting files from BASEROM [new.dat.br]")
         with zipfile.ZipFile(baserom) as rom:
             try:
@@ -675,29 +717,23 @@ def main(baserom, portrom):
             os.remove(i)
         shutil.move('build/portrom/images/super.img', 'build/portrom/super.img')
         green("移植包 [super.img] 提取完毕", "[super.img] extracted.")
-    else:
-        blue("正在提取移植包 [payload.bin]", "Extracting files from PORTROM [payload.bin]")
-        with zipfile.ZipFile(portrom) as rom:
-            try:
-                rom.extract('payload.bin', path='build/portrom')
-            except:
-                red("解压移植包 [payload.bin] 时出错", "Extracting [payload.bin] error")
-                sys.exit()
-        green("移植包 [payload.bin] 提取完毕", "[payload.bin] extracted.")
     # Extract BaseRom Partition
     if baserom_type == 'payload':
         blue("开始分解底包 [payload.bin]", "Unpacking BASEROM [payload.bin]")
-        with open('build/baserom/payload.bin', 'rb') as f:
-            try:
-                Dumper(f, 'build/baserom/images/', False, old='old').run()
-            except:
-                red("分解底包 [payload.bin] 时出错", "Unpacking [payload.bin] failed")
-                sys.exit()
+        try:
+            with Dumper.from_zip(rom_file(baserom), 'build/baserom/images/', diff=False, old='old', parallel_ops=True,
+                                 verify=True, cache=image_cache()) as payload:
+                payload.run()
+        except:
+            red("分解底包 [payload.bin] 时出错", "Unpacking [payload.bin] failed")
+            sys.exit()
     elif is_base_rom_eu:
         blue("开始分解底包 [super.img]", "Unpacking BASEROM [super.img]")
-        super_list = get_parts("build/baserom/super.img")
-        super_list = [i.replace("_a", '') for i in super_list]
-        lpunpack("build/baserom/super.img", 'build/baserom/images', super_list)
+        # Parse (and read in place, if sparse) the base super.img once for both the listing and the extraction
+        with open_super("build/baserom/super.img") as base_super:
+            super_list = base_super.get_info()
+            super_list = [i.replace("_a", '') for i in super_list]
+            base_super.unpack(super_list, 'build/baserom/images', workers=os.cpu_count() or 1)
     elif baserom_type == 'br':
         super_list = []
         blue("开始分解底包 [new.dat.br]", "Unpacking BASEROM[new.dat.br]")
@@ -718,14 +754,18 @@ def main(baserom, portrom):
     for part in track(['system', 'system_dlkm', 'system_ext', 'product', 'product_dlkm', 'mi_ext']):
         img = f'build/baserom/images/{part}.img'
         if os.path.isfile(img):
-            if gettype(img) == 'sparse':
-                simg2img(img)
-            if gettype(img) == 'ext':
+            img_type = gettype(img)
+            if img_type == 'sparse':
+                # Extractor reads sparse ext4 images in place, extract.erofs needs a raw image
+                img_type = sparse_type(img)
+                if img_type != 'ext':
+                    simg2img(img)
+            if img_type == 'ext':
                 blue(f"正在分解底包 {part}.img [ext]", f"Extracing {part}.img [ext] from BASEROM")
                 Extractor().main(img, ('build/baserom/images/' + os.path.basename(img).split('.')[0]))
                 blue(f"分解底包 [{part}.img] 完成", "BASEROM {part}.img [ext] extracted.")
                 os.remove(img)
-            elif gettype(img) == 'erofs':
+            elif img_type == 'erofs':
                 pack_type = 'EROFS'
                 blue(f"正在分解底包 {part}.img [erofs]", f"Extracing {part}.img [erofs] from BASEROM")
                 if call(f'extract.erofs -x -i build/baserom/images/{part}.img  -o build/baserom/images/'):
@@ -753,51 +793,83 @@ def main(baserom, portrom):
                     continue
                 super_list.append(i[0])
     green("开始提取逻辑分区镜像", "Starting extract partition from img")
-    for part in track(super_list):
-        if part in ['vendor', 'odm', 'vendor_dlkm', 'odm_dlkm'] and os.path.isfile(f"build/portrom/images/{part}.img"):
-            blue(f"从底包中提取 [{part}]分区 ...", f"Extracting [{part}] from BASEROM")
+    base_parts = [part for part in super_list if
+                  part in ['vendor', 'odm', 'vendor_dlkm', 'odm_dlkm'] and os.path.isfile(
+                      f"build/portrom/images/{part}.img")]
+    # One handle parses the port super.img or payload.bin manifest once for every partition taken from it.
+    # Partitions are still dumped, extracted and removed one at a time to keep disk usage low.
+    with contextlib.ExitStack() as port_source:
+        if is_eu_rom:
+            port_super = port_source.enter_context(open_super('build/portrom/super.img'))
         else:
-            if is_eu_rom:
-                blue(f"PORTROM super.img 提取 [{part}] 分区...", f"Extracting [{part}] from PORTROM super.img")
-                lpunpack('build/portrom/super.img', 'build/portrom/images', [f"{part}_a"])
-                shutil.move(f"build/portrom/images/{part}_a.img", f"build/portrom/images/{part}.img")
-            else:
+            try:
+                payload = port_source.enter_context(Dumper.from_zip(rom_file(portrom),
+                                                                    'build/portrom/images/',
+                                                                    diff=False,
+                                                                    old='old',
+                                                                    parallel_ops=True,
+                                                                    verify=True,
+                                                                    cache=image_cache()))
+            except:
+                red("读取移植包 payload.bin 时出错", "Reading PORTROM payload.bin failed")
+                sys.exit()
+        for part in track(super_list):
+            if part in base_parts:
+                blue(f"从底包中提取 [{part}]分区 ...", f"Extracting [{part}] from BASEROM")
+            elif not is_eu_rom:
                 blue(f"payload.bin 提取 [{part}] 分区...", f"Extracting [{part}] from PORTROM payload.bin")
-                with open('build/portrom/payload.bin', 'rb') as f:
-                    try:
-                        Dumper(f,
-                               'build/portrom/images/',
-                               diff=False,
-                               old='old',
-                               images=[part]).run()
-                    except:
-                        red(f"提取移植包 [{part}] 分区时出错", f"Extracting partition [{part}] error.")
-                        sys.exit()
-        img = f'build/portrom/images/{part}.img'
-        if os.path.isfile(img):
-            blue(f"开始提取 {part}.img", f"Extracting {part}.img")
-            if gettype(img) == 'sparse':
-                simg2img(img)
-            if gettype(img) == 'ext':
-                pack_type = 'EXT'
                 try:
-                    Extractor().main(img, ('build/portrom/images/' + os.sep + os.path.basename(img).split('.')[0]))
+                    payload.run(images=[part])
                 except:
-                    red(f"提取{part}失败", f"Extracting partition {part} failed")
+                    red(f"提取移植包 [{part}] 分区时出错", f"Extracting partition [{part}] error.")
                     sys.exit()
-                os.makedirs(f'build/portrom/images/{part}/lost+found', exist_ok=True)
-                os.remove(f'build/portrom/images/{part}.img')
-                green(f"提取 [{part}] [ext]镜像完毕", f"Extracting [{part}].img [ext] done")
-            elif gettype(img) == 'erofs':
-                pack_type = 'EROFS'
-                green("移植包为 [erofs] 文件系统", "PORTROM filesystem: [erofs]. ")
-                if read_config('bin/port_config', 'repack_with_ext4') == "true":
+            elif is_eu_rom:
+                blue(f"PORTROM super.img 提取 [{part}] 分区...", f"Extracting [{part}] from PORTROM super.img")
+                # ext4 partitions are extracted straight from super.img, others still need an image file
+                with port_super.open_partition(f"{part}_a") as partition:
+                    in_place = gettype(partition) == 'ext'
+                    if in_place:
+                        pack_type = 'EXT'
+                        try:
+                            Extractor().main(f'build/portrom/images/{part}.img', 'build/portrom/images/' + part,
+                                             image=partition)
+                        except:
+                            red(f"提取{part}失败", f"Extracting partition {part} failed")
+                            sys.exit()
+                if in_place:
+                    os.makedirs(f'build/portrom/images/{part}/lost+found', exist_ok=True)
+                    green(f"提取 [{part}] [ext]镜像完毕", f"Extracting [{part}].img [ext] done")
+                    continue
+                port_super.unpack([f"{part}_a"], 'build/portrom/images')
+                shutil.move(f"build/portrom/images/{part}_a.img", f"build/portrom/images/{part}.img")
+            img = f'build/portrom/images/{part}.img'
+            if os.path.isfile(img):
+                blue(f"开始提取 {part}.img", f"Extracting {part}.img")
+                img_type = gettype(img)
+                if img_type == 'sparse':
+                    img_type = sparse_type(img)
+                    if img_type != 'ext':
+                        simg2img(img)
+                if img_type == 'ext':
                     pack_type = 'EXT'
-                if call(f'extract.erofs -x -i build/portrom/images/{part}.img -o build/portrom/images/'):
-                    red(f"提取{part}失败", "Extracting {part} failed")
-                os.makedirs(f'build/portrom/images/{part}/lost+found', exist_ok=True)
-                os.remove(f'build/portrom/images/{part}.img')
-                green(f"提取移植包[{part}] [erofs]镜像完毕", f"Extracting {part} [erofs] done.")
+                    try:
+                        Extractor().main(img, ('build/portrom/images/' + os.sep + os.path.basename(img).split('.')[0]))
+                    except:
+                        red(f"提取{part}失败", f"Extracting partition {part} failed")
+                        sys.exit()
+                    os.makedirs(f'build/portrom/images/{part}/lost+found', exist_ok=True)
+                    os.remove(f'build/portrom/images/{part}.img')
+                    green(f"提取 [{part}] [ext]镜像完毕", f"Extracting [{part}].img [ext] done")
+                elif img_type == 'erofs':
+                    pack_type = 'EROFS'
+                    green("移植包为 [erofs] 文件系统", "PORTROM filesystem: [erofs]. ")
+                    if read_config('bin/port_config', 'repack_with_ext4') == "true":
+                        pack_type = 'EXT'
+                    if call(f'extract.erofs -x -i build/portrom/images/{part}.img -o build/portrom/images/'):
+                        red(f"提取{part}失败", "Extracting {part} failed")
+                    os.makedirs(f'build/portrom/images/{part}/lost+found', exist_ok=True)
+                    os.remove(f'build/portrom/images/{part}.img')
+                    green(f"提取移植包[{part}] [erofs]镜像完毕", f"Extracting {part} [erofs] done.")
     # Modify The Rom
     blue("正在获取ROM参数", "Fetching ROM build prop.")
     is_ab_device = read_config('build/portrom/images/vendor/build.prop', 'ro.build.ab_update')